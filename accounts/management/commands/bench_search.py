@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.models import UserSearchTerm
+from accounts.search import search_terms, search_users
+
+User = get_user_model()
+
+SYLLABLES = ['al', 'an', 'ar', 'be', 'da', 'el', 'ja', 'jo', 'ka', 'li', 'ma', 'mi', 'na', 'ri', 'sa', 'th', 'vi', 'yu']
+
+
+class Command(BaseCommand):
+    help = 'Time user search lookups against a generated user base (default 1M users)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--legacy', action='store_true', help='Also time the old icontains query (slow)')
+
+    def handle(self, *args, **options):
+        # Everything is created inside a transaction that is rolled back
+        with transaction.atomic():
+            self.run(**options)
+            transaction.set_rollback(True)
+
+    def run(self, users, queries, legacy, **kwargs):
+        rng = random.Random(42)
+
+        def name(parts):
+            return ''.join(rng.choice(SYLLABLES) for _ in range(parts))
+
+        self.stdout.write(f'Creating {users} users...')
+        begin = time.perf_counter()
+        names = []
+        for start in range(0, users, 10000):
+            batch = []
+            for i in range(start, min(start + 10000, users)):
+                username = f'{name(rng.randint(2, 4))}_{i}'
+                display_name = f'{name(2).title()} {name(rng.randint(2, 3)).title()}'
+                batch.append(User(
+                    email=f'bench{i}@example.com', username=username, display_name=display_name,
+                    chat_code=f'bench{i:07d}', password='!',
+                ))
+            User.objects.bulk_create(batch)
+            UserSearchTerm.objects.bulk_create([
+                UserSearchTerm(user=user, kind=kind, term=term)
+                for user in batch
+                for kind, term in search_terms(user.username, user.display_name)
+            ])
+            names.extend((user.username, user.display_name, user.chat_code) for user in batch[:50])
+        self.stdout.write(f'  done in {time.perf_counter() - begin:.0f}s')
+
+        samples = []
+        for _ in range(queries):
+            username, display_name, chat_code = rng.choice(names)
+            samples.append(rng.choice([
+                username[:rng.randint(2, 6)],
+                display_name.split()[1][:rng.randint(2, 5)],
+                chat_code,
+                'zzzz',
+            ]))
+
+        self.report('indexed', samples, lambda q: search_users(q, limit=20))
+        if legacy:
+            self.report('icontains', samples[:10], lambda q: list(User.objects.filter(
+                Q(username__icontains=q) | Q(display_name__icontains=q) | Q(chat_code=q)
+            )[:20]))
+
+    def report(self, label, samples, search):
+        timings = []
+        for q in samples:
+            begin = time.perf_counter()
+            search(q)
+            timings.append((time.perf_counter() - begin) * 1000)
+        timings.sort()
+        self.stdout.write(
+            f'{label:>10}: p50 {statistics.median(timings):.2f} ms, '
+            f'p95 {timings[int(len(timings) * 0.95) - 1]:.2f} ms, max {timings[-1]:.2f} ms'
+        )
@@ -0,0 +1,35 @@
+import re
+
+from django.db import migrations
+
+USERNAME, DISPLAY_NAME, WORD = 0, 1, 2
+
+
+def backfill_search_terms(apps, schema_editor):
+    User = apps.get_model('accounts', 'User')
+    UserSearchTerm = apps.get_model('accounts', 'UserSearchTerm')
+
+    rows = []
+    for user_id, username, display_name in User.objects.values_list('id', 'username', 'display_name').iterator():
+        username = username.lower()
+        display_name = (display_name or '').strip().lower()
+        terms = {(USERNAME, username)}
+        if display_name:
+            terms.add((DISPLAY_NAME, display_name[:50]))
+        for name in (username, display_name):
+            for word in re.split(r'[\W_]+', name)[1:]:
+                if len(word) >= 2:
+                    terms.add((WORD, word[:50]))
+        rows.extend(UserSearchTerm(user_id=user_id, kind=kind, term=term) for kind, term in terms)
+    UserSearchTerm.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_usersearchterm'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_search_terms, migrations.RunPython.noop),
+    ]
@@ -57,3 +57,25 @@ class User(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
+
+
+class UserSearchTerm(models.Model):
+    """
+    Lower-cased names a user can be found by (see accounts.search), so
+    user search is an index range scan instead of a scan of every user.
+    """
+    USERNAME = 0
+    DISPLAY_NAME = 1
+    WORD = 2  # A later word of either name
+
+    user = models.ForeignKey(User, related_name='search_terms', on_delete=models.CASCADE)
+    kind = models.PositiveSmallIntegerField()
+    term = models.CharField(max_length=50)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term']),
+        ]
+
+    def __str__(self):
+        return self.term
@@ -2,10 +2,12 @@
 import json
 import os
 import firebase_admin
-from firebase_admin import credentials, messaging, firestore
+from firebase_admin import credentials
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
+from .push import Push, push_dispatcher
+
 # Initialize Firebase Admin
 # We use a singleton pattern to avoid re-initialization error
 if not firebase_admin._apps:
@@ -44,60 +46,29 @@ def send_notification(request):
     # Health Check (GET) - Verify Firebase Init
     if request.method == 'GET':
         status = "Initialized" if firebase_admin._apps else "Not Initialized"
-        return JsonResponse({'firebase_status': status})
+        return JsonResponse({'firebase_status': status, 'queue_depth': push_dispatcher.queue_depth})
 
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST allowed'}, status=405)
 
     try:
-        print(f"Notification Request: {request.body.decode('utf-8')}")
         data = json.loads(request.body)
         receiver_id = data.get('receiver_id')
-        title = data.get('title', 'New Message')
-        body = data.get('body', 'You have a new message')
-        chat_id = data.get('chat_id', '')
         
         if not receiver_id:
              return JsonResponse({'error': 'receiver_id required'}, status=400)
 
-        # 1. Get FCM Token from Firestore
-        # Note: This assumes utilizing the same project credentials for both Auth and Firestore
-        db = firestore.client()
-        user_doc = db.collection('users').document(receiver_id).get()
-        
-        if not user_doc.exists:
-             return JsonResponse({'error': 'User not found'}, status=404)
-             
-        user_data = user_doc.to_dict()
-        fcm_token = user_data.get('fcm_token')
-        
-        if not fcm_token:
-             return JsonResponse({'error': 'User has no FCM token'}, status=404)
-
-        # 2. Send Message
-        message = messaging.Message(
-            notification=messaging.Notification(
-                title=title,
-                body=body,
-            ),
-            data={
-                'click_action': 'FLUTTER_NOTIFICATION_CLICK',
-                'receiver_id': receiver_id,
-                'chat_id': chat_id,
-            },
-            token=fcm_token,
-            android=messaging.AndroidConfig(
-                priority='high',
-                notification=messaging.AndroidNotification(
-                     channel_id='high_importance_channel',
-                     default_sound=True,
-                     tag=chat_id, # Groups notifications by Chat ID in System Tray
-                ),
-            ),
+        # Token lookup and the FCM call happen on the dispatcher thread,
+        # batched with other pushes (see accounts.push)
+        push = Push(
+            receiver_id,
+            title=data.get('title', 'New Message'),
+            body=data.get('body', 'You have a new message'),
+            chat_id=data.get('chat_id', ''),
         )
-
-        response = messaging.send(message)
-        return JsonResponse({'status': 'sent', 'message_id': response})
+        if not push_dispatcher.submit(push):
+            return JsonResponse({'error': 'Too many pending notifications'}, status=503)
+        return JsonResponse({'status': 'queued', 'queue_depth': push_dispatcher.queue_depth}, status=202)
 
     except Exception as e:
         print(f"Notification Error: {e}")
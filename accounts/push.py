@@ -0,0 +1,317 @@
+import heapq
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+# Outcomes a transport reports for each push it was handed
+SENT = 'sent'
+RETRY = 'retry'  # Temporary failure: send again later
+INVALID_TOKEN = 'invalid_token'  # The token is dead: forget it, don't retry
+
+
+class Push:
+    __slots__ = ('receiver_id', 'title', 'body', 'chat_id', 'attempts')
+
+    def __init__(self, receiver_id, title='New Message', body='You have a new message', chat_id=''):
+        self.receiver_id = str(receiver_id)
+        self.title = title
+        self.body = body
+        self.chat_id = chat_id
+        self.attempts = 0
+
+
+class FcmTransport:
+    """Tokens from the Firestore users collection, pushes through FCM"""
+
+    # FCM takes at most this many messages per batch request
+    max_batch = 500
+
+    def fetch_tokens(self, receiver_ids):
+        """receiver id -> FCM token (None if the user has none), one round trip"""
+        from firebase_admin import firestore
+
+        db = firestore.client()
+        snapshots = db.get_all([db.collection('users').document(receiver_id) for receiver_id in receiver_ids])
+        tokens = dict.fromkeys(receiver_ids)
+        for snapshot in snapshots:
+            if snapshot.exists:
+                tokens[snapshot.id] = (snapshot.to_dict() or {}).get('fcm_token')
+        return tokens
+
+    def send(self, batch):
+        """batch is a list of (token, Push); returns one outcome per push"""
+        from firebase_admin import exceptions, messaging
+
+        messages = [
+            messaging.Message(
+                notification=messaging.Notification(
+                    title=push.title,
+                    body=push.body,
+                ),
+                data={
+                    'click_action': 'FLUTTER_NOTIFICATION_CLICK',
+                    'receiver_id': push.receiver_id,
+                    'chat_id': push.chat_id,
+                },
+                token=token,
+                android=messaging.AndroidConfig(
+                    priority='high',
+                    notification=messaging.AndroidNotification(
+                        channel_id='high_importance_channel',
+                        default_sound=True,
+                        tag=push.chat_id,  # Groups notifications by Chat ID in System Tray
+                    ),
+                ),
+            )
+            for token, push in batch
+        ]
+        try:
+            responses = messaging.send_each(messages).responses
+        except exceptions.FirebaseError as e:
+            print(f"Push batch of {len(batch)} failed: {e}")
+            return [RETRY] * len(batch)
+
+        outcomes = []
+        for response in responses:
+            if response.success:
+                outcomes.append(SENT)
+            elif isinstance(response.exception, (
+                messaging.UnregisteredError, messaging.SenderIdMismatchError, exceptions.InvalidArgumentError
+            )):
+                outcomes.append(INVALID_TOKEN)
+            else:
+                outcomes.append(RETRY)
+        return outcomes
+
+
+class FakeTransport:
+    """
+    Local stand-in for FCM, for tests and benchmarks: every user has a
+    token, sends are recorded in .sent (and batch sizes in .batches), and
+    latency seconds are spent per call to mimic the round trip. fail_next
+    makes that many pushes fail temporarily; pushes to invalid_receivers
+    report a dead token.
+    """
+
+    max_batch = 500
+
+    def __init__(self, latency=0.0, fail_next=0, invalid_receivers=()):
+        self.latency = latency
+        self.fail_next = fail_next
+        self.invalid_receivers = {str(receiver_id) for receiver_id in invalid_receivers}
+        self.sent = []
+        self.batches = []
+        self.lookups = []
+        self.calls = 0
+
+    def fetch_tokens(self, receiver_ids):
+        time.sleep(self.latency)
+        self.lookups.append(len(receiver_ids))
+        return {receiver_id: f'fake-token-{receiver_id}' for receiver_id in receiver_ids}
+
+    def send(self, batch):
+        time.sleep(self.latency)
+        self.calls += 1
+        self.batches.append(len(batch))
+        outcomes = []
+        for token, push in batch:
+            if push.receiver_id in self.invalid_receivers:
+                outcomes.append(INVALID_TOKEN)
+            elif self.fail_next > 0:
+                self.fail_next -= 1
+                outcomes.append(RETRY)
+            else:
+                self.sent.append((token, push))
+                outcomes.append(SENT)
+        return outcomes
+
+
+class FcmTokenCache:
+    """Bounded LRU of receiver id -> FCM token (or None), each kept for ttl seconds"""
+
+    def __init__(self, max_entries=50000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # receiver id -> (expires_at, token)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, receiver_ids):
+        """(receiver id -> token for the cached ones, ids that have to be fetched)"""
+        now = time.monotonic()
+        found, missing = {}, []
+        with self._lock:
+            for receiver_id in receiver_ids:
+                entry = self._entries.get(receiver_id)
+                if entry is None or entry[0] <= now:
+                    self._entries.pop(receiver_id, None)
+                    missing.append(receiver_id)
+                else:
+                    self._entries.move_to_end(receiver_id)
+                    found[receiver_id] = entry[1]
+        return found, missing
+
+    def set_many(self, tokens):
+        expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            for receiver_id, token in tokens.items():
+                self._entries[receiver_id] = (expires_at, token)
+                self._entries.move_to_end(receiver_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, receiver_id):
+        with self._lock:
+            self._entries.pop(receiver_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class PushDispatcher:
+    """
+    Sends push notifications from a background thread so requests and
+    socket handlers only queue them.
+
+    Pushes queued within window seconds of each other go out together:
+    one token lookup for the receivers not in the token cache, then one
+    batch send per max_batch pushes. Pushes that fail temporarily are
+    retried after backoff, 2 * backoff, 4 * backoff, ... seconds, up to
+    max_attempts sends. Once max_queue pushes are waiting, submit()
+    refuses new ones.
+    """
+
+    def __init__(self, transport=None, window=0.05, max_attempts=4, backoff=1.0, max_queue=10000, token_ttl=600):
+        self._transport = transport
+        self.window = window
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_queue = max_queue
+        self.tokens = FcmTokenCache(ttl=token_ttl)
+        self._queue = deque()
+        # (due time, tie breaker, Push) waiting to be retried
+        self._retries = []
+        self._retry_counter = 0
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            self._transport = import_string(getattr(settings, 'PUSH_TRANSPORT', 'accounts.push.FcmTransport'))()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def queue_depth(self):
+        """Pushes queued, waiting for a retry or being sent"""
+        with self._condition:
+            return len(self._queue) + len(self._retries) + self._in_flight
+
+    def submit(self, push):
+        """Queue a push; False if the queue is full"""
+        with self._condition:
+            if len(self._queue) + len(self._retries) >= self.max_queue:
+                return False
+            self._queue.append(push)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='push-dispatcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return True
+
+    def flush(self, timeout=10.0):
+        """Wait until nothing is queued or in flight (retries included); True if that happened"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._queue or self._retries or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._send(batch)
+            except Exception as e:
+                print(f"Error sending {len(batch)} pushes: {e}")
+                for push in batch:
+                    push.attempts += 1
+                    self._retry(push)
+            finally:
+                with self._condition:
+                    self._in_flight -= len(batch)
+                    self._condition.notify_all()
+
+    def _next_batch(self):
+        """Block until pushes are due, give them the window to gather, take them"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                while self._retries and self._retries[0][0] <= now:
+                    self._queue.append(heapq.heappop(self._retries)[2])
+                if self._queue:
+                    break
+                self._condition.wait(self._retries[0][0] - now if self._retries else None)
+
+            gather_until = time.monotonic() + self.window
+            while len(self._queue) < self.transport.max_batch:
+                remaining = gather_until - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+
+            batch = [self._queue.popleft() for _ in range(min(len(self._queue), self.transport.max_batch))]
+            self._in_flight += len(batch)
+            return batch
+
+    def _send(self, batch):
+        receiver_ids = list({push.receiver_id for push in batch})
+        tokens, missing = self.tokens.get_many(receiver_ids)
+        if missing:
+            fetched = self.transport.fetch_tokens(missing)
+            self.tokens.set_many(fetched)
+            tokens.update(fetched)
+
+        ready = [(tokens[push.receiver_id], push) for push in batch if tokens.get(push.receiver_id)]
+        if not ready:
+            return
+        for (token, push), outcome in zip(ready, self.transport.send(ready)):
+            push.attempts += 1
+            if outcome == INVALID_TOKEN:
+                self.tokens.invalidate(push.receiver_id)
+            elif outcome == RETRY:
+                self._retry(push)
+
+    def _retry(self, push):
+        if push.attempts >= self.max_attempts:
+            print(f"Dropping push to {push.receiver_id} after {push.attempts} attempts")
+            return
+        delay = self.backoff * 2 ** max(push.attempts - 1, 0)
+        with self._condition:
+            self._retry_counter += 1
+            heapq.heappush(self._retries, (time.monotonic() + delay, self._retry_counter, push))
+            self._condition.notify()
+
+
+push_dispatcher = PushDispatcher(
+    window=getattr(settings, 'PUSH_BATCH_WINDOW_MS', 50) / 1000,
+    max_attempts=getattr(settings, 'PUSH_MAX_ATTEMPTS', 4),
+    backoff=getattr(settings, 'PUSH_RETRY_BACKOFF', 1.0),
+    max_queue=getattr(settings, 'PUSH_MAX_QUEUE', 10000),
+    token_ttl=getattr(settings, 'FCM_TOKEN_TTL', 600),
+)
@@ -0,0 +1,66 @@
+import re
+
+from django.contrib.auth import get_user_model
+
+from .models import UserSearchTerm
+
+User = get_user_model()
+
+WORD_SPLIT = re.compile(r'[\W_]+')
+# Sorts after anything a term can continue with
+PREFIX_END = '\U0010ffff'
+
+# Better matches first: the username, then the display name, then later words
+RANKED_KINDS = (UserSearchTerm.USERNAME, UserSearchTerm.DISPLAY_NAME, UserSearchTerm.WORD)
+
+
+def search_terms(username, display_name):
+    """(kind, term) pairs a user with these names is found by"""
+    username = username.lower()
+    display_name = (display_name or '').strip().lower()
+    terms = {(UserSearchTerm.USERNAME, username)}
+    if display_name:
+        terms.add((UserSearchTerm.DISPLAY_NAME, display_name[:50]))
+    # "john_doe" and "Mary Jane" are also found by "doe" and "jane"
+    for name in (username, display_name):
+        for word in WORD_SPLIT.split(name)[1:]:
+            if len(word) >= 2:
+                terms.add((UserSearchTerm.WORD, word[:50]))
+    return terms
+
+
+def index_users(users):
+    """Replace the search terms of users with ones built from their current names"""
+    users = list(users)
+    UserSearchTerm.objects.filter(user__in=users).delete()
+    UserSearchTerm.objects.bulk_create([
+        UserSearchTerm(user_id=user.id, kind=kind, term=term)
+        for user in users
+        for kind, term in search_terms(user.username, user.display_name)
+    ], batch_size=1000)
+
+
+def search_users(query, limit=20, exclude_id=None):
+    """
+    Users matching query, best first: an exact chat_code, then names
+    starting with query (username, display name, any later word of
+    either), each kind in name order. At most one small range scan per
+    kind, so the cost does not grow with the number of users.
+    """
+    user_ids = list(User.objects.filter(chat_code=query).values_list('id', flat=True))
+    prefix = query.lower()
+    for kind in RANKED_KINDS:
+        if len(user_ids) >= limit:
+            break
+        # The range uses the (kind, term) index; startswith keeps the
+        # match exact whatever the database collation does at the edges
+        rows = UserSearchTerm.objects.filter(
+            kind=kind, term__gte=prefix, term__lt=prefix + PREFIX_END, term__startswith=prefix
+        ).order_by('term').values_list('user_id', flat=True)
+        for user_id in rows[:limit + 1]:
+            if user_id not in user_ids:
+                user_ids.append(user_id)
+
+    user_ids = [user_id for user_id in user_ids if user_id != exclude_id][:limit]
+    users = User.objects.in_bulk(user_ids)
+    return [users[user_id] for user_id in user_ids if user_id in users]
@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .search import index_users
+from .usernames import username_filter
+
+User = get_user_model()
+
+SEARCHED_FIELDS = {'username', 'display_name'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    """Keep the user search index in step with usernames and display names"""
+    if update_fields is not None and not SEARCHED_FIELDS.intersection(update_fields):
+        return  # e.g. last_login on every sign-in
+    index_users([instance])
+    username_filter.add(instance.username)
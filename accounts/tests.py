@@ -1,3 +1,87 @@
-from django.test import TestCase
+import time
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from accounts.push import FakeTransport, Push, PushDispatcher
+from accounts.usernames import BloomFilter, free_username, username_filter
+
+User = get_user_model()
+
+
+class FreeUsernameTests(TestCase):
+    def setUp(self):
+        # A filter built before "alice" signed up through another worker
+        username_filter._filter = BloomFilter(10000)
+        username_filter._built_at = time.monotonic()
+        User.objects.bulk_create([User(email='alice@example.com', username='alice')])
+
+    def tearDown(self):
+        username_filter._filter = None
+        username_filter._built_at = None
+
+    def test_stale_filter_is_not_trusted(self):
+        self.assertFalse(username_filter.might_exist('alice'))
+        with self.assertNumQueries(1):
+            self.assertEqual(free_username('alice'), 'alice1')
+
+
+class PushDispatcherTests(SimpleTestCase):
+    def dispatcher(self, transport, **options):
+        options.setdefault('window', 0)
+        return PushDispatcher(transport=transport, **options)
+
+    def test_pushes_are_batched(self):
+        transport = FakeTransport()
+        dispatcher = self.dispatcher(transport, window=0.5)
+        for i in range(1200):
+            self.assertTrue(dispatcher.submit(Push(i % 300, chat_id='room')))
+        self.assertTrue(dispatcher.flush())
+
+        self.assertEqual(transport.batches, [500, 500, 200])
+        self.assertEqual(len(transport.sent), 1200)
+        # The first batch has every receiver; later ones hit the token cache
+        self.assertEqual(transport.lookups, [300])
+        self.assertEqual(dispatcher.queue_depth, 0)
+
+    def test_temporary_failures_are_retried_with_backoff(self):
+        transport = FakeTransport(fail_next=2)
+        dispatcher = self.dispatcher(transport, backoff=0.1)
+        started = time.monotonic()
+        dispatcher.submit(Push(1))
+        self.assertTrue(dispatcher.flush())
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.1 + 0.2)
+        self.assertEqual(transport.calls, 3)
+        self.assertEqual([push.receiver_id for _, push in transport.sent], ['1'])
+
+    def test_retries_stop_after_max_attempts(self):
+        transport = FakeTransport(fail_next=10)
+        dispatcher = self.dispatcher(transport, backoff=0.01, max_attempts=3)
+        dispatcher.submit(Push(1))
+        self.assertTrue(dispatcher.flush())
+
+        self.assertEqual(transport.calls, 3)
+        self.assertEqual(transport.sent, [])
+
+    def test_dead_token_is_forgotten_and_not_retried(self):
+        transport = FakeTransport(invalid_receivers=[2])
+        dispatcher = self.dispatcher(transport, backoff=0.01)
+        dispatcher.submit(Push(1))
+        dispatcher.submit(Push(2))
+        self.assertTrue(dispatcher.flush())
+
+        self.assertEqual(transport.calls, 1)
+        self.assertEqual([push.receiver_id for _, push in transport.sent], ['1'])
+        found, missing = dispatcher.tokens.get_many(['1', '2'])
+        self.assertEqual((list(found), missing), (['1'], ['2']))
+
+    def test_full_queue_refuses_pushes(self):
+        transport = FakeTransport()
+        # A long window keeps the pushes queued while we submit
+        dispatcher = self.dispatcher(transport, window=0.5, max_queue=2)
+        self.assertTrue(dispatcher.submit(Push(1)))
+        self.assertTrue(dispatcher.submit(Push(2)))
+        self.assertFalse(dispatcher.submit(Push(3)))
+        self.assertTrue(dispatcher.flush())
+        self.assertEqual(len(transport.sent), 2)
@@ -28,6 +28,7 @@ urlpatterns = [
     # Blocking
     path('block/', views_block.BlockUserView.as_view(), name='block_user'),
     path('unblock/', views_block.UnblockUserView.as_view(), name='unblock_user'),
+    path('block/status/', views_block.BlockStatusBatchView.as_view(), name='block_status_batch'),
     path('block/status/<int:user_id>/', views_block.BlockStatusView.as_view(), name='block_status'),
     
     # Firebase Sync
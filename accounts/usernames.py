@@ -0,0 +1,131 @@
+import hashlib
+import math
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+User = get_user_model()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.01):
+        self.bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class UsernameFilter:
+    """
+    Bloom filter of every username, so availability checks for names
+    nobody has skip the database: "not in the filter" means free, anything
+    else is checked with a query.
+
+    Process-local and built in a background thread on first use (queries
+    answer until it is ready). Users saved in this process are added as
+    they go; it is rebuilt every rebuild_interval seconds to pick up names
+    taken through other workers and to forget renamed ones. The answer is
+    a hint for availability checks only: picking a username to save
+    always asks the database.
+    """
+
+    def __init__(self, rebuild_interval=600, error_rate=0.01):
+        self.rebuild_interval = rebuild_interval
+        self.error_rate = error_rate
+        self._filter = None
+        self._built_at = None
+        self._building = False
+        # Names saved while a rebuild reads the table
+        self._added_during_build = []
+        self._lock = threading.Lock()
+
+    def might_exist(self, username):
+        """False only if no user has this username"""
+        with self._lock:
+            bloom = self._filter
+            stale = self._built_at is None or self._built_at + self.rebuild_interval <= time.monotonic()
+            if (stale or bloom is None or bloom.count > bloom.capacity) and not self._building:
+                self._building = True
+                self._added_during_build = []
+                threading.Thread(target=self._rebuild, daemon=True).start()
+        if bloom is None:
+            return True
+        return username in bloom
+
+    def add(self, username):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(username)
+            if self._building:
+                self._added_during_build.append(username)
+
+    def _rebuild(self):
+        try:
+            total = User.objects.count()
+            # Room to grow before the false positive rate climbs
+            bloom = BloomFilter(max(total * 2, 10000), self.error_rate)
+            for username in User.objects.values_list('username', flat=True).iterator(chunk_size=10000):
+                bloom.add(username)
+            with self._lock:
+                for username in self._added_during_build:
+                    bloom.add(username)
+                self._filter = bloom
+                self._built_at = time.monotonic()
+        except Exception as e:
+            print(f"Error building username filter: {e}")
+        finally:
+            connection.close()
+            with self._lock:
+                self._building = False
+                self._added_during_build = []
+
+
+def free_username(base):
+    """
+    base if nobody has it, else base<N> for the smallest free N >= 1
+    (one query). The username filter is not consulted: it can miss names
+    taken through other workers, and this name gets saved.
+    """
+    pattern = re.escape(base) + '([0-9]*)'
+    suffix = re.compile(pattern)
+    taken = set()
+    candidates = User.objects.filter(username__startswith=base, username__regex=f'^{pattern}$')
+    for username in candidates.values_list('username', flat=True):
+        match = suffix.fullmatch(username)
+        if match is None:
+            continue
+        digits = match.group(1)
+        if not digits:
+            taken.add(0)
+        elif digits == str(int(digits)):
+            taken.add(int(digits))
+    if 0 not in taken:
+        return base
+    counter = 1
+    while counter in taken:
+        counter += 1
+    return f'{base}{counter}'
+
+
+username_filter = UsernameFilter(
+    rebuild_interval=getattr(settings, 'USERNAME_FILTER_REBUILD_INTERVAL', 600),
+)
@@ -5,7 +5,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import get_user_model, authenticate
-from django.db.models import Q
+from .search import search_users
 from .serializers import UserSerializer, RegisterSerializer, CustomTokenObtainPairSerializer, LoginSerializer
 
 User = get_user_model()
@@ -64,10 +64,8 @@ class UserSearchView(APIView):
         if len(query) < 2:
             return Response({'error': 'Query must be at least 2 characters'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Search by username or chat_code
-        users = User.objects.filter(
-            Q(username__icontains=query) | Q(display_name__icontains=query) | Q(chat_code=query)
-        ).exclude(id=request.user.id)[:20]
+        # Exact chat_code, then names starting with the query (indexed, see accounts.search)
+        users = search_users(query, limit=20, exclude_id=request.user.id)
         
         serializer = UserSerializer(users, many=True)
         return Response(serializer.data)
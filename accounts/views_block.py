@@ -3,6 +3,7 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.contrib.auth import get_user_model
+from chat.blocks import block_index
 from chat.models import BlockedUser
 from django.db.models import Q
 
@@ -48,13 +49,37 @@ class BlockStatusView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request, user_id):
-        user = request.user
+        return Response(block_status(block_index.get(request.user.id), user_id))
+
+
+def block_status(blocks, user_id):
+    is_blocked_by_me = user_id in blocks.blocked
+    is_blocked_by_them = user_id in blocks.blocked_by
+    return {
+        'is_blocked_by_me': is_blocked_by_me,
+        'is_blocked_by_them': is_blocked_by_them,
+        'is_blocked': is_blocked_by_me or is_blocked_by_them
+    }
+
+
+class BlockStatusBatchView(APIView):
+    """
+    Block status of many users at once: ?user_ids=1,2,3 returns
+    {"1": {...}, "2": {...}, ...} in the same shape as block/status/<id>/
+    """
+    permission_classes = [IsAuthenticated]
+    max_ids = 500
+    
+    def get(self, request):
+        try:
+            user_ids = [int(user_id) for user_id in request.query_params.get('user_ids', '').split(',') if user_id.strip()]
+        except ValueError:
+            return Response({'error': 'user_ids must be a comma-separated list of ids'}, status=status.HTTP_400_BAD_REQUEST)
         
-        is_blocked_by_me = BlockedUser.objects.filter(blocker=user, blocked__id=user_id).exists()
-        is_blocked_by_them = BlockedUser.objects.filter(blocker__id=user_id, blocked=user).exists()
+        if not user_ids:
+            return Response({'error': 'user_ids is required'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(user_ids) > self.max_ids:
+            return Response({'error': f'At most {self.max_ids} user_ids'}, status=status.HTTP_400_BAD_REQUEST)
         
-        return Response({
-            'is_blocked_by_me': is_blocked_by_me,
-            'is_blocked_by_them': is_blocked_by_them,
-            'is_blocked': is_blocked_by_me or is_blocked_by_them
-        })
+        blocks = block_index.get(request.user.id)
+        return Response({str(user_id): block_status(blocks, user_id) for user_id in user_ids})
@@ -9,6 +9,7 @@ import uuid
 User = get_user_model()
 
 from .serializers import UserSerializer
+from .usernames import free_username
 from rest_framework_simplejwt.tokens import RefreshToken
 
 class FirebaseSyncView(APIView):
@@ -30,12 +31,8 @@ class FirebaseSyncView(APIView):
             if not username:
                 username = email.split('@')[0]
             
-            # Ensure unique username
-            base_username = username
-            counter = 1
-            while User.objects.filter(username=username).exists():
-                username = f"{base_username}{counter}"
-                counter += 1
+            # Ensure unique username (username, username1, username2, ...)
+            username = free_username(username)
             
             user = User.objects.create_user(
                 username=username,
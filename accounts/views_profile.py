@@ -4,6 +4,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from .serializers import UserSerializer
+from .usernames import username_filter
 from django.core.files.storage import default_storage
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
@@ -132,8 +133,10 @@ class CheckUsernameAvailabilityView(APIView):
         if len(username) < 3 or len(username) > 30:
             return Response({'available': False, 'error': 'Invalid length'})
         
-        # Check availability
-        is_available = not User.objects.filter(username=username).exclude(id=request.user.id).exists()
+        # Check availability: most names typed here are free, and the
+        # filter says so without a query
+        is_available = not username_filter.might_exist(username) or \
+            not User.objects.filter(username=username).exclude(id=request.user.id).exists()
         
         return Response({'available': is_available})
 
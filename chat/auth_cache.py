@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+class UserSnapshot:
+    """
+    The fields the socket consumers need from a user, without a model
+    instance (and without a query to build one on a cache hit).
+    """
+
+    is_authenticated = True
+    is_anonymous = False
+
+    __slots__ = ('id', 'pk', 'username', 'email', 'display_name', 'profile_picture_url')
+
+    def __init__(self, id, username, email, display_name='', profile_picture_url=None):
+        self.id = self.pk = id
+        self.username = username
+        self.email = email
+        self.display_name = display_name
+        self.profile_picture_url = profile_picture_url
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            display_name=user.display_name,
+            profile_picture_url=user.profile_picture.url if user.profile_picture else None,
+        )
+
+    def __str__(self):
+        return self.email
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified access token -> UserSnapshot.
+
+    Entries live for at most ttl seconds and never past the token's own
+    expiry. Saving or deleting a user drops every entry for that user in
+    this process; other workers keep serving the old snapshot until ttl
+    runs out, so ttl bounds how long they can.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # token digest -> (expires_at, snapshot)
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return snapshot
+
+    def set(self, token, snapshot, token_exp):
+        expires_at = min(time.time() + self.ttl, token_exp)
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (expires_at, snapshot)
+            self._entries.move_to_end(key)
+            self._by_user.setdefault(snapshot.id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        _, snapshot = self._entries.pop(key)
+        keys = self._by_user.get(snapshot.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[snapshot.id]
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+
+token_cache = TokenCache(
+    max_entries=getattr(settings, 'WS_AUTH_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'WS_AUTH_CACHE_TTL', 60),
+)
@@ -0,0 +1,80 @@
+from collections import namedtuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import BlockedUser
+
+# Users one user has blocked, and users who have blocked them
+UserBlocks = namedtuple('UserBlocks', ['blocked', 'blocked_by'])
+
+
+class BlockIndex:
+    """
+    UserBlocks of each user, kept in the Django cache so every worker sees
+    a block as soon as it is committed. A check is one cache read; a miss
+    costs one query covering both directions. Saving or deleting a
+    BlockedUser row drops both users (and again once committed). Entries
+    expire after ttl seconds, which bounds a load that read the rows just
+    before a change and stored them just after.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+
+    def _key(self, user_id):
+        return f'blocks:{user_id}'
+
+    @staticmethod
+    def _blocks(value):
+        blocked, blocked_by = value
+        return UserBlocks(frozenset(blocked), frozenset(blocked_by))
+
+    def load(self, user_id):
+        blocked, blocked_by = set(), set()
+        rows = BlockedUser.objects.filter(Q(blocker_id=user_id) | Q(blocked_id=user_id))
+        for blocker_id, blocked_id in rows.values_list('blocker_id', 'blocked_id'):
+            if blocker_id == user_id:
+                blocked.add(blocked_id)
+            else:
+                blocked_by.add(blocker_id)
+        cache.set(self._key(user_id), (sorted(blocked), sorted(blocked_by)), self.ttl)
+        return UserBlocks(frozenset(blocked), frozenset(blocked_by))
+
+    def get(self, user_id):
+        value = cache.get(self._key(user_id))
+        return self._blocks(value) if value is not None else self.load(user_id)
+
+    async def aget(self, user_id):
+        value = await cache.aget(self._key(user_id))
+        if value is None:
+            return await database_sync_to_async(self.load)(user_id)
+        return self._blocks(value)
+
+    @staticmethod
+    def _between(blocks, other_id):
+        return other_id in blocks.blocked or other_id in blocks.blocked_by
+
+    def is_blocked(self, user_id, other_id):
+        """Either of the two has blocked the other"""
+        return self._between(self.get(user_id), other_id)
+
+    async def ais_blocked(self, user_id, other_id):
+        return self._between(await self.aget(user_id), other_id)
+
+    async def ablocks_any(self, user_id, other_ids):
+        """user_id and any of other_ids have blocked one another"""
+        blocks = await self.aget(user_id)
+        return any(self._between(blocks, other_id) for other_id in other_ids)
+
+    def invalidate(self, *user_ids):
+        keys = [self._key(user_id) for user_id in user_ids]
+        cache.delete_many(keys)
+        # Again after commit: a load in between may have read the old rows
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+block_index = BlockIndex(ttl=getattr(settings, 'BLOCK_INDEX_TTL', 60))
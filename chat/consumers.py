@@ -1,15 +1,28 @@
-import json
-import base64
+import re
+import uuid
+import asyncio
+from datetime import timedelta
+from urllib.parse import parse_qs
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from .models import Room, Message
+from .blocks import block_index
+from .offline_push import offline_pushes
+from .persistence import message_writer
+from .rooms import room_registry, slug_user_ids
+from .presence import presence
+from .typing_indicator import typing_tracker
+from .sequence import room_sequencer
+from .message_cache import recent_messages
+from . import conversations
+from .protocol import FrameCodecMixin, prepare_frames, encode_edit_content
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(FrameCodecMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = 'chat_%s' % self.room_name
@@ -20,18 +33,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_negotiated()
+        self.confirm_tasks = set()
+
+        # ?resume=<seq>: replay what the client missed since its last event
+        self.replayed_seqs = {}
+        query_params = parse_qs(self.scope.get('query_string', b'').decode())
+        resume_seq = self.parse_seq(query_params.get('resume', [None])[0])
+        if resume_seq is not None:
+            await self.resume_room(self.room_name, resume_seq)
         
         if self.scope['user'].is_authenticated:
-            await self.update_user_status(True)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_status',
-                    'user_id': self.scope['user'].id,
-                    'status': 'online'
-                }
-            )
+            await presence.connect(self.scope['user'].id, self.channel_name)
+            await self.announce_status(self.room_name, 'online')
 
     async def disconnect(self, close_code):
         # Leave room group
@@ -41,59 +55,69 @@ class ChatConsumer(AsyncWebsocketConsumer):
         )
         
         if self.scope['user'].is_authenticated:
-            await self.update_user_status(False)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_status',
-                    'user_id': self.scope['user'].id,
-                    'status': 'offline',
-                    'last_seen': timezone.now().isoformat()
-                }
-            )
+            await typing_tracker.stop(self.room_name, self.scope['user'].id, self.typing_announcer(self.room_name, self.scope['user'].id))
+
+        # Only report offline once the user's last socket (chat or
+        # notification) has closed
+        if self.scope['user'].is_authenticated and await presence.disconnect(self.scope['user'].id, self.channel_name):
+            await self.announce_status(self.room_name, 'offline')
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
+    async def announce_status(self, room_name, status):
+        event = {
+            'type': 'user_status',
+            'room': room_name,
+            'user_id': self.scope['user'].id,
+            'status': status
+        }
+        if status == 'offline':
+            event['last_seen'] = timezone.now().isoformat()
+        await self.channel_layer.group_send('chat_%s' % room_name, event)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        text_data_json = self.decode_frame(text_data, bytes_data)
+        await self.handle_room_frame(self.room_name, text_data_json)
+
+    async def handle_room_frame(self, room_name, text_data_json):
+        """Handle a client frame addressed to one room"""
+        room_group_name = 'chat_%s' % room_name
         
         # Check if this is a special event type
         event_type = text_data_json.get('type', 'chat_message')
         
         if event_type == 'edit_message':
-            await self.handle_edit_message(text_data_json)
+            await self.handle_edit_message(text_data_json, room_name)
             return
 
         if event_type == 'typing':
              sender_id = text_data_json.get('sender_id')
              if self.scope['user'].is_authenticated:
                  sender_id = self.scope['user'].id
-                 
-             await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'typing_status',
-                    'sender_id': sender_id,
-                    'is_typing': text_data_json.get('is_typing', True)
-                }
-            )
-             return
 
-        if event_type == 'delete_message':
-            await self.handle_delete_message(text_data_json)
-            return
+             # Only start/stop edges (plus a periodic re-announce) reach the room
+             await typing_tracker.update(
+                 room_name,
+                 sender_id,
+                 bool(text_data_json.get('is_typing', True)),
+                 self.typing_announcer(room_name, sender_id)
+             )
+             return
 
         if event_type == 'delete_message':
-            await self.handle_delete_message(text_data_json)
+            await self.handle_delete_message(text_data_json, room_name)
             return
 
         # ==========================================
         # WebRTC Signaling Events
         # ==========================================
         if event_type in ['call_offer', 'call_answer', 'ice_candidate', 'call_end', 'call_rejected']:
+            if self.scope['user'].is_authenticated and await self.blocked_in_room(room_name, self.scope['user'].id):
+                return
             # Relay these messages directly to the room group
             await self.channel_layer.group_send(
-                self.room_group_name,
+                room_group_name,
                 {
                     'type': 'webrtc_signal',
+                    'room': room_name,
                     'signal_type': event_type,
                     'sender_id': self.scope['user'].id if self.scope['user'].is_authenticated else None,
                     'payload': text_data_json.get('payload', {})
@@ -105,6 +129,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message = text_data_json.get('message', '')
         message_type = text_data_json.get('message_type', 'text')
         sender_id = text_data_json.get('sender_id')
+        # Lets the client match the durable ack to its optimistic bubble
+        client_id = text_data_json.get('client_id') or uuid.uuid4().hex
         
         # Fallback to scope user if available
         if self.scope['user'].is_authenticated:
@@ -116,71 +142,281 @@ class ChatConsumer(AsyncWebsocketConsumer):
             except User.DoesNotExist:
                 user = None
 
-        msg_obj = None
-        if user and message:
-            msg_obj = await self.save_message(user, message, message_type)
+        if not user or not message:
+            # Nothing to store, so no sequence number is used up
+            return
 
-        if msg_obj:
-            timestamp = msg_obj.timestamp.isoformat()
-            # Notify for Global Updates (Home Screen)
-            await self.notify_participants(msg_obj)
+        if await self.blocked_in_room(room_name, user.id):
+            await self.send_event({'type': 'error', 'error': 'Blocked', 'room': room_name, 'client_id': client_id})
+            return
+
+        # Queue the write and broadcast straight away; the write-behind
+        # pipeline commits it with other pending messages and we ack once
+        # the batch has landed.
+        seq = await room_sequencer.next(room_name)
+        pending = message_writer.submit(room_name, user.id, message, message_type, seq=seq)
 
         # Send message to room group
+        event = {
+            'type': 'chat_message',
+            'room': room_name,
+            'seq': seq,
+            'message': message,
+            'message_type': message_type,
+            'sender_id': sender_id,
+            'timestamp': timezone.now().isoformat(),
+            'id': None,
+            'client_id': client_id,
+            'is_read': False
+        }
+        await self.publish_room_event(self.channel_layer, room_name, event)
+
+        # Referenced until done, so it is neither collected mid-flight nor
+        # fails without a trace
+        task = asyncio.ensure_future(self.confirm_message(pending, client_id, room_name, event))
+        self.confirm_tasks.add(task)
+        task.add_done_callback(self.confirm_done)
+
+    def confirm_done(self, task):
+        self.confirm_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error confirming message: {task.exception()!r}")
+
+    async def blocked_in_room(self, room_name, user_id):
+        """user_id and another member of the room have blocked one another"""
+        entry = room_registry.get(room_name)
+        if entry is None:
+            entry = await database_sync_to_async(room_registry.load)(room_name)
+        # No room yet: the first message creates it with the users its slug names
+        member_ids = entry.participant_ids if entry is not None else slug_user_ids(room_name)
+        return await block_index.ablocks_any(user_id, [pid for pid in member_ids if pid != user_id])
+
+    async def confirm_message(self, pending, client_id, room_name, event):
+        """Ack a queued message to the room once its batch is committed"""
+        try:
+            msg_obj = await pending
+        except Exception as e:
+            print(f"Error saving message: {e}")
+            msg_obj = None
+
+        # The replay buffer holds the broadcast, sent before there was an
+        # id: clients resuming from it get the stored message instead (or
+        # nothing if the write failed). Done before the ack so no client
+        # can miss both.
+        if msg_obj:
+            committed = {name: value for name, value in event.items() if name != 'frames'}
+            committed.update(id=msg_obj.id, timestamp=msg_obj.timestamp.isoformat())
+            await room_sequencer.amend(room_name, event['seq'], self.with_frames(committed)['frames'])
+        else:
+            await room_sequencer.amend(room_name, event['seq'], None)
+
         await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'message_type': message_type,
-                'sender_id': sender_id,
-                'timestamp': timestamp,
+            'chat_%s' % room_name,
+            self.with_frames({
+                'type': 'message_ack',
+                'room': room_name,
+                'client_id': client_id,
                 'id': msg_obj.id if msg_obj else None,
-                'is_read': False
-            }
+                'timestamp': msg_obj.timestamp.isoformat() if msg_obj else None,
+                'status': 'saved' if msg_obj else 'failed',
+            })
         )
 
-    async def chat_message(self, event):
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps({
+        if msg_obj:
+            # Notify for Global Updates (Home Screen)
+            await self.notify_participants(msg_obj, room_name)
+
+    # Room-wide events are encoded once by the sender (see with_frames) and
+    # written verbatim by every member; events from older senders without
+    # 'frames' are still encoded here.
+
+    @staticmethod
+    def chat_message_payload(event):
+        return {
+            'room': event.get('room'),
+            'seq': event.get('seq'),
             'message': event['message'],
             'message_type': event.get('message_type', 'text'),
             'sender_id': event['sender_id'],
             'timestamp': event.get('timestamp'),
             'id': event.get('id'),
+            'client_id': event.get('client_id'),
             'is_read': event.get('is_read', False),
+            'is_edited': event.get('is_edited', False),
             'call_status': event.get('call_status'),  # Preserve status
             'call_duration': event.get('call_duration'), # Preserve duration
-        }))
+        }
+
+    @staticmethod
+    def message_ack_payload(event):
+        return {
+            'type': 'message_ack',
+            'room': event.get('room'),
+            'client_id': event['client_id'],
+            'id': event['id'],
+            'timestamp': event['timestamp'],
+            'status': event['status'],
+        }
+
+    @staticmethod
+    def message_deleted_payload(event):
+        return {
+            'type': 'message_deleted',
+            'room': event.get('room'),
+            'seq': event.get('seq'),
+            'message_ids': event['message_ids'],
+            'delete_type': event['delete_type']
+        }
+
+    @staticmethod
+    def message_edited_payload(event, new_content):
+        return {
+            'type': 'message_edited',
+            'room': event.get('room'),
+            'seq': event.get('seq'),
+            'message_id': event['message_id'],
+            'new_content': new_content,
+        }
+
+    @classmethod
+    def with_frames(cls, event):
+        """Attach the pre-encoded client frames to a group event"""
+        if event['type'] == 'message_edited':
+            event['frames'] = prepare_frames(
+                cls.message_edited_payload(event, encode_edit_content(event['new_content'])),
+                cls.message_edited_payload(event, event['new_content']),
+            )
+        else:
+            event['frames'] = prepare_frames(getattr(cls, f"{event['type']}_payload")(event))
+        return event
+
+    @classmethod
+    async def publish_room_event(cls, channel_layer, room_name, event):
+        """Encode a sequenced room event once, keep it for replay and broadcast it"""
+        cls.with_frames(event)
+        await room_sequencer.record(room_name, event['seq'], event['frames'])
+        await channel_layer.group_send('chat_%s' % room_name, event)
+
+    @staticmethod
+    def message_event(room_name, msg):
+        """The chat_message group event for a stored message"""
+        return {
+            'type': 'chat_message',
+            'room': room_name,
+            'seq': msg.seq,
+            'message': msg.content,
+            'message_type': msg.message_type,
+            'sender_id': msg.sender_id,
+            'timestamp': msg.timestamp.isoformat(),
+            'id': msg.id,
+            'is_read': msg.is_read,
+            'is_edited': msg.is_edited,
+            'call_status': msg.call_status,
+            'call_duration': msg.call_duration,
+        }
+
+    @staticmethod
+    def parse_seq(value):
+        try:
+            seq = int(value)
+        except (TypeError, ValueError):
+            return None
+        return seq if seq >= 0 else None
+
+    async def resume_room(self, room_name, after_seq):
+        """Send the room events after after_seq, then where the live stream picks up"""
+        events = await room_sequencer.replay(room_name, after_seq)
+        complete = True
+        if events is None:
+            # Older than the buffer: rebuild from the stored messages
+            messages, complete = await database_sync_to_async(room_sequencer.load_since)(room_name, after_seq)
+            events = [
+                (msg.seq, prepare_frames(self.chat_message_payload(self.message_event(room_name, msg))))
+                for msg in messages
+            ]
+
+        # Live events that raced with the replay are not sent twice
+        replayed = self.replayed_seqs.setdefault(room_name, set())
+        for seq, frames in events:
+            replayed.add(seq)
+            await self.send_frames(frames)
+
+        # complete=False means some events could not be replayed (deletes,
+        # or too many); the client should refetch the room
+        await self.send_event({
+            'type': 'resumed',
+            'room': room_name,
+            'seq': events[-1][0] if events else after_seq,
+            'complete': complete,
+        })
+
+    def is_replayed(self, event):
+        seq = event.get('seq')
+        return seq is not None and seq in self.replayed_seqs.get(event.get('room'), ())
+
+    async def chat_message(self, event):
+        if self.is_replayed(event):
+            return
+        # Send message to WebSocket
+        if 'frames' in event:
+            await self.send_frames(event['frames'])
+        else:
+            await self.send_event(self.chat_message_payload(event))
+
+    async def message_ack(self, event):
+        if 'frames' in event:
+            await self.send_frames(event['frames'])
+        else:
+            await self.send_event(self.message_ack_payload(event))
 
     async def user_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'user_status',
+            'room': event.get('room'),
             'user_id': event['user_id'],
             'status': event['status'],
             'last_seen': event.get('last_seen')
-        }))
+        })
+
+    def typing_announcer(self, room_name, sender_id):
+        group_name = 'chat_%s' % room_name
+
+        async def announce(is_typing):
+            await self.channel_layer.group_send(
+                group_name,
+                {
+                    'type': 'typing_status',
+                    'room': room_name,
+                    'sender_id': sender_id,
+                    'is_typing': is_typing
+                }
+            )
+        return announce
 
     async def typing_status(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'typing',
+            'room': event.get('room'),
             'sender_id': event['sender_id'],
             'is_typing': event['is_typing']
-        }))
+        })
 
     async def read_status_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'read_receipt',
+            'room': event.get('room'),
             'reader_id': event['reader_id']
-        }))
+        })
 
     async def user_update(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': 'user_update',
+            'room': event.get('room'),
             'user_id': event['user_id'],
             'profile_picture': event['profile_picture']
-        }))
+        })
 
-    async def handle_delete_message(self, data):
+    async def handle_delete_message(self, data, room_name):
         """Handle message deletion requests"""
         if not self.scope['user'].is_authenticated:
             print("Delete failed: User not authenticated")
@@ -190,152 +426,97 @@ class ChatConsumer(AsyncWebsocketConsumer):
         delete_type = data.get('delete_type', 'me')
         user = self.scope['user']
 
-        print(f"\n=== DELETE REQUEST ===")
-        print(f"User: {user.username} (ID: {user.id})")
-        print(f"Message IDs: {message_ids}")
-        print(f"Delete Type: {delete_type}")
-
-        deleted_ids = await self.process_delete_messages(user, message_ids, delete_type)
-        
-        print(f"Successfully deleted IDs: {deleted_ids}")
-        print(f"======================\n")
+        seq = await room_sequencer.next(room_name) if delete_type == 'everyone' else None
+        deleted_ids = await self.process_delete_messages(user, message_ids, delete_type, room_name, seq)
         
         if deleted_ids:
             if delete_type == 'everyone':
                 # Broadcast to all users in the room
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_deleted',
-                        'message_ids': deleted_ids,
-                        'delete_type': 'everyone'
-                    }
-                )
+                await self.publish_room_event(self.channel_layer, room_name, {
+                    'type': 'message_deleted',
+                    'room': room_name,
+                    'seq': seq,
+                    'message_ids': deleted_ids,
+                    'delete_type': 'everyone'
+                })
             else:
                 # Send only to the requesting user
-                await self.send(text_data=json.dumps({
-                    'type': 'message_deleted',
+                await self.send_event(self.message_deleted_payload({
+                    'room': room_name,
                     'message_ids': deleted_ids,
                     'delete_type': 'me'
                 }))
 
     async def message_deleted(self, event):
         """Broadcast message deletion to clients"""
-        await self.send(text_data=json.dumps({
-            'type': 'message_deleted',
-            'message_ids': event['message_ids'],
-            'delete_type': event['delete_type']
-        }))
+        if self.is_replayed(event):
+            return
+        if 'frames' in event:
+            await self.send_frames(event['frames'])
+        else:
+            await self.send_event(self.message_deleted_payload(event))
 
     @database_sync_to_async
-    def process_delete_messages(self, user, message_ids, delete_type):
-        """Process message deletion in database"""
+    def process_delete_messages(self, user, message_ids, delete_type, room_name, seq=None):
+        """Process message deletion in database with set-based queries"""
         from django.db import transaction
+        from django.db.models import F
+        from django.db.models.functions import Greatest
+        
+        # Convert all IDs to integers, keeping only real (positive) database IDs
+        clean_ids = set()
+        for msg_id in message_ids:
+            try:
+                clean_id = int(msg_id)
+            except (ValueError, TypeError):
+                continue
+            if clean_id > 0:
+                clean_ids.add(clean_id)
         
-        deleted_ids = []
+        if not clean_ids:
+            return []
         
         try:
-            # Convert all IDs to integers
-            clean_ids = []
-            for msg_id in message_ids:
-                try:
-                    clean_id = int(msg_id)
-                    if clean_id > 0:  # Only process positive IDs (real database IDs)
-                        clean_ids.append(clean_id)
-                except (ValueError, TypeError):
-                    print(f"Invalid ID: {msg_id}")
-                    continue
-            
-            if not clean_ids:
-                print("No valid IDs to delete")
-                return []
-            
-            print(f"Clean IDs to process: {clean_ids}")
-            
             with transaction.atomic():
-                messages = Message.objects.filter(id__in=clean_ids)
-                print(f"Found {messages.count()} messages in database")
+                if delete_type == 'everyone':
+                    # Ownership and the 15 minute window are checked in SQL
+                    deletable = Message.objects.filter(
+                        id__in=clean_ids,
+                        room__slug=room_name,
+                        sender_id=user.id,
+                        timestamp__gte=timezone.now() - timedelta(seconds=900)
+                    )
+                    deleted_ids = list(deletable.values_list('id', flat=True))
+                    # HARD DELETE from database (deleted_by rows go with them)
+                    Message.objects.filter(id__in=deleted_ids).delete()
+                    if deleted_ids and seq is not None:
+                        # Resuming from before this point can't be served from the database
+                        Room.objects.filter(slug=room_name).update(last_delete_seq=Greatest(F('last_delete_seq'), seq))
+                    if deleted_ids:
+                        conversations.messages_deleted(room_name)
+                    # Bumped once the rows are gone, or a page read in between
+                    # would be cached under the new version
+                    transaction.on_commit(lambda: recent_messages.messages_deleted(room_name, deleted_ids))
+                    return deleted_ids
                 
-                for msg in messages:
-                    if delete_type == 'everyone':
-                        # Check ownership and time limit (15 minutes)
-                        time_diff = timezone.now() - msg.timestamp
-                        seconds = time_diff.total_seconds()
-                        is_owner = (msg.sender.id == user.id)
-                        
-                        print(f"Message {msg.id}: Owner={is_owner}, Age={seconds}s")
-                        
-                        if is_owner and seconds <= 900:  # 15 minutes
-                            # HARD DELETE from database
-                            msg_id = msg.id
-                            msg.delete()
-                            deleted_ids.append(msg_id)
-                            print(f"DELETED message {msg_id} from database")
-                        else:
-                            print(f"Cannot delete message {msg.id}: Owner={is_owner}, TimeOK={seconds <= 900}")
-                            
-                    elif delete_type == 'me':
-                        # Soft delete: add user to deleted_by
-                        msg.deleted_by.add(user)
-                        deleted_ids.append(msg.id)
-                        print(f"Soft deleted message {msg.id} for user {user.username}")
-                        
+                if delete_type == 'me':
+                    # Soft delete: one INSERT into the deleted_by through table
+                    deleted_ids = list(Message.objects.filter(id__in=clean_ids, room__slug=room_name).values_list('id', flat=True))
+                    DeletedBy = Message.deleted_by.through
+                    DeletedBy.objects.bulk_create(
+                        [DeletedBy(message_id=msg_id, user_id=user.id) for msg_id in deleted_ids],
+                        ignore_conflicts=True
+                    )
+                    if deleted_ids:
+                        conversations.messages_hidden(room_name, user.id)
+                    transaction.on_commit(lambda: recent_messages.messages_hidden(room_name, user.id, deleted_ids))
+                    return deleted_ids
         except Exception as e:
-            import traceback
             print(f"ERROR in process_delete_messages: {e}")
-            print(traceback.format_exc())
-            return []
         
-        return deleted_ids
+        return []
 
-    @database_sync_to_async
-    def save_message(self, user, message, message_type='text'):
-        try:
-            # Create room if it doesn't exist
-            room, created = Room.objects.get_or_create(
-                slug=self.room_name,
-                defaults={'name': self.room_name}
-            )
-            
-            # Add user as participant if not already added
-            if not room.participants.filter(id=user.id).exists():
-                room.participants.add(user)
-            
-            # Extract other user ID from room name (format: user1_user2)
-            if created:
-                try:
-                    user_ids = self.room_name.split('_')
-                    for uid in user_ids:
-                        try:
-                            other_user = User.objects.get(id=int(uid))
-                            if other_user.id != user.id:
-                                room.participants.add(other_user)
-                        except (User.DoesNotExist, ValueError):
-                            pass
-                except:
-                    pass
-            
-            # Create message
-            msg = Message.objects.create(
-                room=room,
-                sender=user,
-                content=message,
-                message_type=message_type
-            )
-            return msg
-        except Exception as e:
-            print(f"Error saving message: {e}")
-            return None
-
-    @database_sync_to_async
-    def update_user_status(self, is_online):
-        if self.scope['user'].is_authenticated:
-            user = self.scope['user']
-            user.is_online = is_online
-            if not is_online:
-                user.last_seen = timezone.now()
-            user.save()
-    async def handle_edit_message(self, data):
+    async def handle_edit_message(self, data, room_name):
         message_id = data.get('message_id')
         new_content_encoded = data.get('new_content')
         
@@ -343,52 +524,51 @@ class ChatConsumer(AsyncWebsocketConsumer):
             return
 
         try:
-            # Decode content
-            new_content_bytes = base64.b64decode(new_content_encoded)
-            new_content = new_content_bytes.decode('utf-8')
-            
-            # Get message and verify ownership
-            # Use filter().first() to avoid exceptions
-            message = await database_sync_to_async(lambda: Message.objects.filter(id=message_id).first())()
+            # Decode content (base64 on JSON sockets, raw text on binary ones)
+            new_content = self.decode_edit_content(new_content_encoded)
             
-            if not message:
+            if not self.scope['user'].is_authenticated:
                 return
-                
-            if self.scope['user'].is_authenticated:
-                if message.sender_id != self.scope['user'].id:
-                    return # Not sender
-            else:
-                 return # Guest? Should be authenticated
             
-            # Check time limit (15 mins)
-            age = timezone.now() - message.timestamp
-            if age.total_seconds() > 900:
-                return # Too old
-                
-            # Update
-            message.content = new_content
-            message.is_edited = True
-            await database_sync_to_async(message.save)()
+            # Sender and time limit are checked in the UPDATE itself
+            seq = await room_sequencer.next(room_name)
+            updated = await self.process_edit_message(self.scope['user'], room_name, message_id, new_content, seq)
+            if not updated:
+                return # Missing, not sender, or too old
             
             # Broadcast
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'message_edited',
-                    'message_id': message_id,
-                    'new_content': new_content_encoded, # Send back encoded to keep format consistent
-                }
-            )
+            await self.publish_room_event(self.channel_layer, room_name, {
+                'type': 'message_edited',
+                'room': room_name,
+                'seq': seq,
+                'message_id': message_id,
+                'new_content': new_content,
+            })
             
         except Exception as e:
             print(f"Error editing message: {e}")
 
+    @database_sync_to_async
+    def process_edit_message(self, user, room_name, message_id, new_content, seq):
+        """Edit a message in one conditional UPDATE. Returns the number of rows changed"""
+        updated = Message.objects.filter(
+            id=message_id,
+            room__slug=room_name,
+            sender_id=user.id,
+            timestamp__gte=timezone.now() - timedelta(seconds=900)
+        ).update(content=new_content, is_edited=True, seq=seq)
+        if updated:
+            conversations.message_edited(room_name)
+            recent_messages.message_edited(room_name, int(message_id), new_content)
+        return updated
+
     async def message_edited(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_edited',
-            'message_id': event['message_id'],
-            'new_content': event['new_content'],
-        }))
+        if self.is_replayed(event):
+            return
+        if 'frames' in event:
+            await self.send_frames(event['frames'])
+        else:
+            await self.send_event(self.message_edited_payload(event, self.encode_edit_content(event['new_content'])))
 
     async def webrtc_signal(self, event):
         """
@@ -402,27 +582,32 @@ class ChatConsumer(AsyncWebsocketConsumer):
         if sender_id and current_user_id and sender_id == current_user_id:
             return
 
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             'type': event['signal_type'], # e.g., 'call_offer'
+            'room': event.get('room'),
             'sender_id': sender_id,
             'payload': event['payload']
-        }))
+        })
 
 
-    async def notify_participants(self, msg_obj):
-        participants = await database_sync_to_async(lambda: list(msg_obj.room.participants.all()))()
-        sender_id = await database_sync_to_async(lambda: msg_obj.sender.id)()
+    async def notify_participants(self, msg_obj, room_name):
+        entry = room_registry.get(room_name)
+        if entry is None:
+            entry = await database_sync_to_async(room_registry.load)(room_name)
+        if entry is None:
+            return
+        sender_id = msg_obj.sender_id
         
-        for p in participants:
-            if p.id != sender_id:
+        for participant_id in entry.participant_ids:
+            if participant_id != sender_id:
                 # Send to their global notification channel
                 await self.channel_layer.group_send(
-                    f'user_{p.id}',
+                    f'user_{participant_id}',
                     {
                         'type': 'chat_notification', # Handled by NotificationConsumer
                         'notification_type': 'new_message',
                         'payload': {
-                            'room': self.room_name,
+                            'room': room_name,
                             'message': msg_obj.content,
                             'message_type': msg_obj.message_type,
                             'sender_id': sender_id,
@@ -431,8 +616,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     }
                 )
 
+        # Members with no socket open get a push instead (collapsed per room)
+        sender = self.scope['user']
+        if sender.is_authenticated and sender.id == sender_id:
+            title = sender.display_name or sender.username
+        else:
+            title = 'New Message'
+        preview = msg_obj.content if msg_obj.message_type == 'text' else f'Sent a {msg_obj.message_type}'
+        await offline_pushes.message_sent(
+            room_name,
+            [participant_id for participant_id in entry.participant_ids if participant_id != sender_id],
+            title,
+            preview,
+        )
+
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+class NotificationConsumer(FrameCodecMixin, AsyncWebsocketConsumer):
     async def connect(self):
         if not self.scope['user'].is_authenticated:
             await self.close()
@@ -446,7 +645,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             self.group_name,
             self.channel_name
         )
-        await self.accept()
+        await self.accept_negotiated()
+        await presence.connect(self.user.id, self.channel_name)
 
     async def disconnect(self, close_code):
         if self.scope['user'].is_authenticated:
@@ -454,10 +654,14 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.group_name,
                 self.channel_name
             )
+            await presence.disconnect(self.user.id, self.channel_name)
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.handle_notification_frame(self.decode_frame(text_data, bytes_data))
+
+    async def handle_notification_frame(self, data):
+        """Handle a client frame addressed to another user (calls, call logs)"""
         try:
-            data = json.loads(text_data)
             message_type = data.get('type')
             
             # Target user to send notification to
@@ -468,6 +672,12 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
             target_group = f'user_{target_user_id}'
 
+            # No calls between users who blocked one another
+            if message_type != 'save_call_log' and await block_index.ais_blocked(self.user.id, int(target_user_id)):
+                if message_type == 'call_invite':
+                    await self.send_event({'type': 'error', 'error': 'Blocked', 'target_user_id': target_user_id})
+                return
+
             if message_type == 'call_invite':
                 # Send invitation to target user
                 await self.channel_layer.group_send(
@@ -477,7 +687,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                         'notification_type': 'call_invite',
                         'sender_id': self.user.id,
                         'sender_name': self.user.username,
-                        'sender_avatar': self.user.profile_picture.url if self.user.profile_picture else None,
+                        'sender_avatar': self.user.profile_picture_url,
                         'payload': data.get('payload', {})
                     }
                 )
@@ -522,48 +732,28 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
             
             # Add participants
-            room.participants.add(self.user)
+            room.participants.add(self.user.id)
             room.participants.add(User.objects.get(id=peer_id))
             
             # Create call message
+            seq = async_to_sync(room_sequencer.next)(room_slug)
             message = Message.objects.create(
                 room=room,
                 sender_id=caller_id,
                 content='',  # Empty for call messages
                 message_type='call',
                 call_duration=duration,
-                call_status=status
+                call_status=status,
+                seq=seq
             )
-            
-            # Serialize for broadcast
-            from .serializers import MessageSerializer
-            # We can't use serializer easy in sync_to_async without more wrapping, so construct dict manually
-            msg_data = {
-                'id': message.id,
-                'sender': message.sender.id,
-                'content': message.content,
-                'timestamp': message.timestamp.isoformat(),
-                'message_type': 'call',
-                'call_duration': duration,
-                'call_status': status,
-                'is_read': message.is_read
-            }
+            conversations.messages_written([message])
+            recent_messages.messages_saved([(room_slug, message)])
 
             # Broadcast to room group (so ChatScreen receives it)
-            channel_layer = self.channel_layer
-            async_to_sync(channel_layer.group_send)(
-                f"chat_{room_slug}", 
-                {
-                    'type': 'chat_message',
-                    'message': message.content, # Content is empty but field required
-                    'message_type': 'call',
-                    'sender_id': message.sender.id,
-                    'timestamp': message.timestamp.isoformat(),
-                    'id': message.id,
-                    'is_read': message.is_read,
-                    'call_status': status,
-                    'call_duration': duration,
-                }
+            async_to_sync(ChatConsumer.publish_room_event)(
+                self.channel_layer,
+                room_slug,
+                ChatConsumer.message_event(room_slug, message)
             )
             
             print(f"Call log saved and broadcast: {status}, duration: {duration}s")
@@ -571,8 +761,92 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             print(f"Error saving call log: {e}")
 
     async def call_notification(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
 
     async def chat_notification(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send_event(event)
+
+
+
+class MultiplexConsumer(ChatConsumer, NotificationConsumer):
+    """
+    One socket per client carrying the personal notification stream and any
+    number of rooms, authenticated once at connect.
+
+    Client frames:
+      {'type': 'subscribe', 'room': <slug>, 'resume': <seq, optional>}
+      {'type': 'unsubscribe', 'room': <slug>}
+      frames with 'target_user_id' - same as on ws/notify/
+      any other frame with 'room' - same as on ws/chat/<room>/
+    Every room event sent back carries 'room' so the client can route it.
+    """
+
+    room_name_regex = re.compile(r'^\w+$')
+
+    async def connect(self):
+        if not self.scope['user'].is_authenticated:
+            await self.close()
+            return
+
+        self.user = self.scope['user']
+        self.group_name = f'user_{self.user.id}'
+        self.rooms = set()
+        self.replayed_seqs = {}
+        self.confirm_tasks = set()
+
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept_negotiated()
+        await presence.connect(self.user.id, self.channel_name)
 
+    async def disconnect(self, close_code):
+        if not self.scope['user'].is_authenticated:
+            return
+
+        await self.channel_layer.group_discard(
+            self.group_name,
+            self.channel_name
+        )
+        rooms = list(self.rooms)
+        for room_name in rooms:
+            await self.leave_room(room_name)
+
+        if await presence.disconnect(self.user.id, self.channel_name):
+            for room_name in rooms:
+                await self.announce_status(room_name, 'offline')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode_frame(text_data, bytes_data)
+        event_type = data.get('type')
+        room_name = data.get('room')
+
+        if event_type == 'subscribe':
+            await self.join_room(room_name, self.parse_seq(data.get('resume')))
+        elif event_type == 'unsubscribe':
+            if room_name in self.rooms:
+                await self.leave_room(room_name)
+                await self.send_event({'type': 'unsubscribed', 'room': room_name})
+        elif data.get('target_user_id'):
+            await self.handle_notification_frame(data)
+        elif room_name in self.rooms:
+            await self.handle_room_frame(room_name, data)
+
+    async def join_room(self, room_name, resume_seq=None):
+        if not isinstance(room_name, str) or not self.room_name_regex.match(room_name):
+            await self.send_event({'type': 'error', 'error': 'Invalid room', 'room': room_name})
+            return
+        if room_name not in self.rooms:
+            self.rooms.add(room_name)
+            await self.channel_layer.group_add('chat_%s' % room_name, self.channel_name)
+            await self.announce_status(room_name, 'online')
+        await self.send_event({'type': 'subscribed', 'room': room_name})
+        if resume_seq is not None:
+            await self.resume_room(room_name, resume_seq)
+
+    async def leave_room(self, room_name):
+        self.rooms.discard(room_name)
+        self.replayed_seqs.pop(room_name, None)
+        await self.channel_layer.group_discard('chat_%s' % room_name, self.channel_name)
+        await typing_tracker.stop(room_name, self.user.id, self.typing_announcer(room_name, self.user.id))
@@ -0,0 +1,175 @@
+import random
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Conversation, Message, Room
+
+
+class ListVersions:
+    """
+    Per-user version of the conversation list, served as its ETag. Kept in
+    the Django cache; a user with no stored version gets a fresh random one,
+    so an ETag from before an eviction or restart never matches.
+    """
+
+    timeout = 7 * 86400
+
+    def _key(self, user_id):
+        return f'conversations:version:{user_id}'
+
+    def get(self, user_id):
+        key = self._key(user_id)
+        version = cache.get(key)
+        if version is None:
+            version = random.getrandbits(48)
+            if not cache.add(key, version, self.timeout):
+                version = cache.get(key, version)
+        return version
+
+    def bump(self, user_ids):
+        for user_id in user_ids:
+            try:
+                cache.incr(self._key(user_id))
+            except ValueError:
+                pass  # Nothing stored; the next get() starts a new version
+
+
+list_versions = ListVersions()
+
+
+def touch_users(user_ids):
+    """The conversation lists of user_ids changed: bump their versions once committed"""
+    user_ids = set(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: list_versions.bump(user_ids))
+
+
+def touch_rooms(**room_filter):
+    """Bump the list version of every member of the rooms matching room_filter"""
+    touch_users(Conversation.objects.filter(**room_filter).values_list('user_id', flat=True))
+
+
+def visible_messages(room_id, user_id):
+    """Messages of a room that user_id can see"""
+    return Message.objects.filter(room_id=room_id, is_deleted_everyone=False).exclude(deleted_by=user_id)
+
+
+def refresh(conversations):
+    """Recompute last message and unread count of conversation rows from scratch"""
+    conversations = list(conversations)
+    for conversation in conversations:
+        visible = visible_messages(conversation.room_id, conversation.user_id)
+        last_message = visible.order_by('-timestamp', '-id').first()
+        conversation.last_message = last_message
+        conversation.last_activity = last_message.timestamp if last_message else None
+        conversation.unread_count = visible.filter(id__gt=conversation.last_read_id).exclude(sender_id=conversation.user_id).count()
+    Conversation.objects.bulk_update(conversations, ['last_message', 'last_activity', 'unread_count'])
+    touch_users(conversation.user_id for conversation in conversations)
+
+
+def sync_members(room_id):
+    """Make the room's conversation rows match its participants"""
+    member_ids = set(Room.participants.through.objects.filter(room_id=room_id).values_list('user_id', flat=True))
+    removed = Conversation.objects.filter(room_id=room_id).exclude(user_id__in=member_ids)
+    touch_users(removed.values_list('user_id', flat=True))
+    removed.delete()
+
+    existing = {conversation.user_id: conversation for conversation in Conversation.objects.filter(room_id=room_id)}
+    created = []
+    changed = []
+    for user_id in member_ids:
+        others = sorted(member_ids - {user_id})
+        other_user_id = others[0] if others else None
+        conversation = existing.get(user_id)
+        if conversation is None:
+            created.append(Conversation(user_id=user_id, room_id=room_id, other_user_id=other_user_id))
+        elif conversation.other_user_id != other_user_id:
+            conversation.other_user_id = other_user_id
+            changed.append(conversation)
+
+    Conversation.objects.bulk_update(changed, ['other_user'])
+    touch_users(conversation.user_id for conversation in changed)
+    if created:
+        Conversation.objects.bulk_create(created, ignore_conflicts=True)
+        refresh(Conversation.objects.filter(room_id=room_id, user_id__in=[c.user_id for c in created]))
+
+
+def remove_user(user_id):
+    Conversation.objects.filter(user_id=user_id).delete()
+    touch_users([user_id])
+
+
+def remove_room(room_id):
+    touch_rooms(room_id=room_id)
+    Conversation.objects.filter(room_id=room_id).delete()
+
+
+def friends_changed(user_ids):
+    """Profiles or presence of user_ids changed; they show up in their friends' lists"""
+    touch_users(Conversation.objects.filter(other_user_id__in=user_ids).values_list('user_id', flat=True))
+
+
+def messages_written(messages):
+    """New messages were saved: move each room's pointer and bump unread counts"""
+    by_room = {}
+    for msg in messages:
+        if msg is not None:
+            by_room.setdefault(msg.room_id, []).append(msg)
+
+    for room_id, room_messages in by_room.items():
+        newest = max(room_messages, key=lambda msg: (msg.timestamp, msg.id))
+        Conversation.objects.filter(room_id=room_id).filter(
+            Q(last_activity__isnull=True) | Q(last_activity__lte=newest.timestamp)
+        ).update(last_message=newest, last_activity=newest.timestamp)
+
+        for sender_id, count in Counter(msg.sender_id for msg in room_messages).items():
+            Conversation.objects.filter(room_id=room_id).exclude(user_id=sender_id).update(
+                unread_count=F('unread_count') + count
+            )
+
+    if by_room:
+        touch_rooms(room_id__in=list(by_room))
+
+
+def message_edited(room_slug):
+    """The edited message may be the one shown in the list"""
+    touch_rooms(room__slug=room_slug)
+
+
+def messages_deleted(room_slug):
+    """Messages were deleted for everyone"""
+    refresh(Conversation.objects.filter(room__slug=room_slug))
+
+
+def messages_hidden(room_slug, user_id):
+    """user_id deleted messages for themselves"""
+    refresh(Conversation.objects.filter(room__slug=room_slug, user_id=user_id))
+
+
+def room_read(room_id, user_id):
+    """user_id has read everything in the room so far: one row, however long the backlog"""
+    newest = Message.objects.filter(room_id=room_id).order_by('-id').values('id')[:1]
+    Conversation.objects.filter(room_id=room_id, user_id=user_id).update(
+        last_read_id=Greatest(F('last_read_id'), Coalesce(Subquery(newest), 0)),
+        unread_count=0,
+    )
+    # The reader's unread count and the other members' "seen" state
+    touch_rooms(room_id=room_id)
+
+
+def apply_read_state(messages):
+    """Set is_read on message instances from their rooms' read watermarks (one query)"""
+    watermarks = {}
+    rows = Conversation.objects.filter(room_id__in={msg.room_id for msg in messages})
+    for room_id, user_id, last_read_id in rows.values_list('room_id', 'user_id', 'last_read_id'):
+        watermarks.setdefault(room_id, []).append((user_id, last_read_id))
+    for msg in messages:
+        msg.is_read = any(
+            last_read_id >= msg.id
+            for user_id, last_read_id in watermarks.get(msg.room_id, ())
+            if user_id != msg.sender_id
+        )
@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+
+from .models import FriendRequest
+
+
+class FriendGraph:
+    """
+    Friend ids of each user (accepted requests either way), kept in the
+    Django cache so every worker shares them. A miss costs one query on
+    the (from_user, to_user) rows; any change to a friend request drops
+    the sets of both users once it is committed.
+    """
+
+    timeout = 86400
+
+    def _key(self, user_id):
+        return f'friends:{user_id}'
+
+    def friends(self, user_id):
+        """frozenset of the user's friend ids"""
+        key = self._key(user_id)
+        friend_ids = cache.get(key)
+        if friend_ids is None:
+            rows = FriendRequest.objects.filter(
+                Q(from_user_id=user_id) | Q(to_user_id=user_id), status='accepted'
+            ).values_list('from_user_id', 'to_user_id')
+            friend_ids = {other for pair in rows for other in pair} - {user_id}
+            cache.set(key, sorted(friend_ids), self.timeout)
+        return frozenset(friend_ids)
+
+    def are_friends(self, user_id, other_id):
+        return other_id in self.friends(user_id)
+
+    def invalidate(self, *user_ids):
+        keys = [self._key(user_id) for user_id in user_ids]
+        cache.delete_many(keys)
+        # Again after commit: a read in between may have cached the old rows
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+friend_graph = FriendGraph()
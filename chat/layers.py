@@ -0,0 +1,155 @@
+import bisect
+import hashlib
+import uuid
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer, InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+
+class HashRing:
+    """
+    Consistent hash ring used to pick a backend for a group or channel.
+    Each node gets several virtual points so adding or removing a backend
+    only moves roughly 1/N of the chat_<room> / user_<id> groups.
+    """
+
+    def __init__(self, nodes, replicas=64):
+        self.nodes = [str(node) for node in nodes]
+        ring = []
+        for index, node in enumerate(self.nodes):
+            for replica in range(replicas):
+                ring.append((self._hash(f"{node}#{replica}"), index))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._owners = [owner for _, owner in ring]
+
+    @staticmethod
+    def _hash(value):
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        return int.from_bytes(hashlib.md5(value).digest()[:8], 'big')
+
+    def get_index(self, key):
+        """Return the index of the node owning key"""
+        if len(self.nodes) == 1:
+            return 0
+        position = bisect.bisect(self._points, self._hash(key))
+        if position == len(self._points):
+            position = 0
+        return self._owners[position]
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """
+    Redis channel layer that spreads groups and channels over its hosts with
+    a consistent hash ring instead of channels_redis' fixed CRC buckets.
+    """
+
+    def __init__(self, hosts=None, ring_replicas=64, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.ring = HashRing([self._host_key(host) for host in self.hosts], replicas=ring_replicas)
+
+    @staticmethod
+    def _host_key(host):
+        if isinstance(host, dict):
+            return host.get('address') or ','.join(f"{k}={v}" for k, v in sorted(host.items()))
+        return str(host)
+
+    def consistent_hash(self, value):
+        return self.ring.get_index(value)
+
+
+# Fake backends shared by every LocalShardedChannelLayer in this process,
+# keyed by host name, so several layer instances behave like several workers
+# talking to the same Redis cluster.
+_local_shards = {}
+
+
+def get_local_shard(name, **kwargs):
+    shard = _local_shards.get(name)
+    if shard is None:
+        shard = _local_shards[name] = InMemoryChannelLayer(**kwargs)
+    return shard
+
+
+class LocalShardedChannelLayer(BaseChannelLayer):
+    """
+    In-process stand-in for ShardedRedisChannelLayer.
+
+    Uses the same hash ring and msgpack round trip as the Redis layer, but the
+    shards are process-global InMemoryChannelLayer instances. Create several
+    layers with the same hosts to load-test multi-worker fan-out on one box.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        hosts=None,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        ring_replicas=64,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.hosts = list(hosts or ['local://shard0'])
+        self.ring = HashRing(self.hosts, replicas=ring_replicas)
+        self.shards = [
+            get_local_shard(
+                host,
+                expiry=expiry,
+                group_expiry=group_expiry,
+                capacity=capacity,
+                channel_capacity=channel_capacity,
+            )
+            for host in self.hosts
+        ]
+        self.client_prefix = uuid.uuid4().hex
+
+    def _shard(self, name):
+        return self.shards[self.ring.get_index(name)]
+
+    def shard_index(self, name):
+        """Index of the backend a group or channel name is routed to"""
+        return self.ring.get_index(self.non_local_name(name))
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        # Same wire format as Redis, so unserializable events fail here too
+        message = msgpack.unpackb(msgpack.packb(message, use_bin_type=True), raw=False)
+        await self._shard(self.non_local_name(channel)).send(channel, message)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        return await self._shard(self.non_local_name(channel)).receive(channel)
+
+    async def new_channel(self, prefix="specific"):
+        return f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+
+    async def flush(self):
+        for shard in self.shards:
+            await shard.flush()
+
+    async def close(self):
+        pass
+
+    async def group_add(self, group, channel):
+        await self._shard(group).group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        await self._shard(group).group_discard(group, channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        shard = self._shard(group)
+        shard._clean_expired()
+        for channel in list(shard.groups.get(group, {})):
+            try:
+                await self.send(channel, message)
+            except ChannelFull:
+                pass
@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.consumers import ChatConsumer
+
+
+class Command(BaseCommand):
+    help = 'Compare CPU per room broadcast: per-member encoding vs frames encoded once by the sender'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='2,10,50,200,1000', help='Comma-separated room sizes')
+        parser.add_argument('--broadcasts', type=int, default=200)
+        parser.add_argument('--binary-share', type=float, default=0.5, help='Fraction of MessagePack sockets')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per size; the fastest is reported')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(**options))
+
+    def make_members(self, size, binary_share):
+        members = []
+        binary_count = int(size * binary_share)
+        for i in range(size):
+            consumer = ChatConsumer()
+            consumer.binary_frames = i < binary_count
+
+            async def send(text_data=None, bytes_data=None):
+                pass
+            consumer.send = send
+            members.append(consumer)
+        return members
+
+    def event(self, i):
+        return {
+            'type': 'chat_message',
+            'message': f'Benchmark message number {i} with a bit of text in it',
+            'message_type': 'text',
+            'sender_id': 42,
+            'timestamp': '2026-01-01T12:00:00.000000+00:00',
+            'id': None,
+            'client_id': f'client-{i}',
+            'is_read': False,
+        }
+
+    async def measure(self, members, broadcasts, pre_encode):
+        start = time.process_time()
+        for i in range(broadcasts):
+            event = self.event(i)
+            if pre_encode:
+                event = ChatConsumer.with_frames(event)
+            for member in members:
+                await member.chat_message(event)
+        return (time.process_time() - start) / broadcasts * 1e6
+
+    async def run(self, sizes, broadcasts, binary_share, repeat, **kwargs):
+        self.stdout.write(f"{'room size':>10} {'per-member us':>15} {'encode-once us':>15} {'speedup':>8}")
+        for size in [int(s) for s in sizes.split(',')]:
+            members = self.make_members(size, binary_share)
+            # Best of several runs: single runs swing by 2x on a busy machine
+            legacy = min([await self.measure(members, broadcasts, pre_encode=False) for _ in range(repeat)])
+            encoded = min([await self.measure(members, broadcasts, pre_encode=True) for _ in range(repeat)])
+            self.stdout.write(f'{size:>10} {legacy:>15.1f} {encoded:>15.1f} {legacy / encoded:>7.1f}x')
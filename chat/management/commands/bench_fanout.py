@@ -0,0 +1,60 @@
+import asyncio
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from chat.layers import LocalShardedChannelLayer
+
+
+class Command(BaseCommand):
+    help = 'Load-test multi-worker group fan-out on the in-process sharded channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Simulated Daphne workers')
+        parser.add_argument('--shards', type=int, default=4, help='Fake backend nodes')
+        parser.add_argument('--rooms', type=int, default=200)
+        parser.add_argument('--members', type=int, default=2, help='Sockets per room')
+        parser.add_argument('--messages', type=int, default=20, help='Messages sent per room')
+
+    def handle(self, *args, **options):
+        asyncio.run(self.run(**options))
+
+    async def run(self, workers, shards, rooms, members, messages, **kwargs):
+        hosts = [f'bench://shard{i}' for i in range(shards)]
+        layers = [LocalShardedChannelLayer(hosts=hosts, capacity=messages * 2) for _ in range(workers)]
+        await layers[0].flush()
+
+        # Spread each room's sockets over the workers, like a load balancer would
+        sockets = []
+        for room in range(rooms):
+            group = f'chat_{room}'
+            for member in range(members):
+                layer = layers[(room + member) % workers]
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                sockets.append((layer, channel))
+
+        start = time.perf_counter()
+        for i in range(messages):
+            for room in range(rooms):
+                sender = layers[room % workers]
+                await sender.group_send(f'chat_{room}', {'type': 'chat_message', 'message': f'msg {i}', 'sender_id': room})
+        send_elapsed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        delivered = 0
+        for layer, channel in sockets:
+            for _ in range(messages):
+                await layer.receive(channel)
+                delivered += 1
+        receive_elapsed = time.perf_counter() - start
+
+        distribution = Counter(layers[0].shard_index(f'chat_{room}') for room in range(rooms))
+        sent = rooms * messages
+
+        self.stdout.write(f'{workers} workers, {shards} shards, {rooms} rooms x {members} sockets')
+        self.stdout.write(f'group_send: {sent} events in {send_elapsed:.3f}s ({sent / send_elapsed:.0f}/s)')
+        self.stdout.write(f'receive:    {delivered} frames in {receive_elapsed:.3f}s ({delivered / receive_elapsed:.0f}/s)')
+        self.stdout.write('groups per shard: ' + ', '.join(f'{hosts[i]}={distribution[i]}' for i in range(shards)))
+        await layers[0].flush()
@@ -0,0 +1,73 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from chat.models import Message, Room
+from chat.serializers import MessageSerializer
+from chat.views import messages_before
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare room history page latency by depth: OFFSET pages vs keyset (before=<id>) pages, '
+        'and count the queries to serialize each page'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=100000, help='Messages in the benchmark room')
+        parser.add_argument('--depths', default='1,10,100,1000,2000', help='Comma-separated page numbers')
+        parser.add_argument('--page-size', type=int, default=40)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Everything is created inside a transaction that is rolled back
+        with transaction.atomic():
+            self.run(**options)
+            transaction.set_rollback(True)
+
+    def run(self, messages, depths, page_size, repeat, **kwargs):
+        sender = User.objects.create_user('bench-history@example.com', username='bench_history')
+        room = Room.objects.create(slug='bench_history', name='bench_history')
+        for start in range(0, messages, 5000):
+            Message.objects.bulk_create([
+                Message(room=room, sender=sender, content=f'message {i}')
+                for i in range(start, min(start + 5000, messages))
+            ])
+        ids = list(Message.objects.filter(room=room).order_by('-timestamp', '-id').values_list('id', flat=True))
+
+        request = RequestFactory().get('/')
+        request.user = sender
+
+        self.stdout.write(f"{'page':>8} {'offset ms':>10} {'keyset ms':>10} {'serializer queries':>19}")
+        for page in [int(d) for d in depths.split(',')]:
+            start = (page - 1) * page_size
+            if start >= len(ids):
+                continue
+
+            begin = time.perf_counter()
+            for _ in range(repeat):
+                list(Message.objects.filter(room=room).order_by('-timestamp')[start:start + page_size])
+            offset_ms = (time.perf_counter() - begin) / repeat * 1000
+
+            begin = time.perf_counter()
+            for _ in range(repeat):
+                if start:
+                    # The cursor is the oldest message of the previous page
+                    keyset_page = list(messages_before(room, ids[start - 1], page_size))
+                else:
+                    keyset_page = list(Message.objects.filter(room=room).order_by('-timestamp', '-id')[:page_size])
+            keyset_ms = (time.perf_counter() - begin) / repeat * 1000
+
+            if [m.id for m in keyset_page] != ids[start:start + page_size]:
+                self.stderr.write(f'page {page}: keyset page does not match the offset page')
+
+            # Should stay the same for any page size (senders and "deleted by me" are batched)
+            with CaptureQueriesContext(connection) as queries:
+                MessageSerializer(keyset_page, many=True, context={'request': request}).data
+            self.stdout.write(f'{page:>8} {offset_ms:>10.2f} {keyset_ms:>10.2f} {len(queries.captured_queries):>19}')
@@ -0,0 +1,296 @@
+import json
+import random
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers
+
+from .serializers import MessageRowSerializer, render_message
+
+# Messages per page of room history
+HISTORY_PAGE_SIZE = 40
+
+
+class RoomVersions:
+    """
+    Per-room version of the message history, kept in the Django cache so
+    every worker sees every write. A room with no stored version gets a
+    fresh random one, so nothing cached before an eviction matches it.
+    """
+
+    timeout = 86400
+
+    def _key(self, room_slug):
+        return f'messages:version:{room_slug}'
+
+    def get(self, room_slug):
+        key = self._key(room_slug)
+        version = cache.get(key)
+        if version is None:
+            version = random.getrandbits(48)
+            if not cache.add(key, version, self.timeout):
+                version = cache.get(key, version)
+        return version
+
+    def bump(self, room_slug):
+        """The new version, or None if none was stored"""
+        try:
+            return cache.incr(self._key(room_slug))
+        except ValueError:
+            return None
+
+
+class FillToken:
+    __slots__ = ('version',)
+
+    def __init__(self, version):
+        self.version = version
+
+
+class RoomMessages:
+    __slots__ = ('rows', 'deleted_by', 'complete', 'version', 'size')
+
+    def __init__(self, rows, deleted_by, complete, version):
+        # Serialized rows, oldest -> newest, at most one page
+        self.rows = rows
+        # message id -> ids of users who deleted it for themselves
+        self.deleted_by = deleted_by
+        # True when the room has no messages older than rows
+        self.complete = complete
+        # Room version the rows are up to date with
+        self.version = version
+        self.size = 0
+
+
+class RecentMessageCache:
+    """
+    Page 1 of the history of active rooms, already serialized.
+
+    The rows are process-local. The chat write paths (message writer, call
+    logs, edits, deletes, mark-read) bump the room's shared version and
+    patch the rows as they go; anything that can't be patched drops the
+    room, and the next read refills it. A page is only served while its
+    version is the shared one, so a write through another worker makes
+    the next read here refill (one cache round trip per hit). Sender profiles
+    are kept once per user, dropped when the user is saved, and presence
+    flushes patch is_online / last_seen in place. Rooms are evicted least
+    recently used once the rows use more than max_bytes.
+    """
+
+    def __init__(self, per_room=HISTORY_PAGE_SIZE, max_bytes=32 * 1024 * 1024):
+        self.per_room = per_room
+        self.max_bytes = max_bytes
+        self.versions = RoomVersions()
+        self._rooms = OrderedDict()
+        self._senders = {}
+        # room -> token of a read in progress; any write to the room
+        # cancels it so a fill can't store rows that are already stale
+        self._filling = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._rooms)
+
+    @property
+    def size(self):
+        return self._bytes
+
+    def page(self, room_slug, user_id):
+        """Page 1 as MessageSerializer renders it for user_id, or None on a miss"""
+        with self._lock:
+            if room_slug not in self._rooms:
+                return None
+        version = self.versions.get(room_slug)
+        with self._lock:
+            entry = self._rooms.get(room_slug)
+            if entry is None or entry.version != version:
+                # Written elsewhere since; the fill replaces it
+                return None
+            senders = [self._senders.get(row['sender_id']) for row in entry.rows]
+            if None in senders:
+                return None
+            self._rooms.move_to_end(room_slug)
+            return [
+                render_message(row, sender, user_id in entry.deleted_by.get(row['id'], ()))
+                for row, sender in zip(entry.rows, senders)
+            ]
+
+    def begin_fill(self, room_slug):
+        # Read before the rows, so a write in between leaves them outdated
+        token = FillToken(self.versions.get(room_slug))
+        with self._lock:
+            self._filling[room_slug] = token
+        return token
+
+    def fill(self, room_slug, token, data, deleted_by, complete):
+        """
+        Cache a page read from the database: data is MessageSerializer
+        output (oldest -> newest) and deleted_by maps message id -> user ids.
+        """
+        rows = []
+        senders = {}
+        for item in data:
+            senders[item['sender_id']] = item['sender']
+            rows.append({name: value for name, value in item.items() if name not in ('sender', 'is_deleted_by_me')})
+
+        with self._lock:
+            if self._filling.get(room_slug) is not token:
+                return
+            del self._filling[room_slug]
+            self._senders.update(senders)
+            self._store(room_slug, RoomMessages(rows, deleted_by, complete, token.version))
+
+    def _store(self, room_slug, entry):
+        old = self._rooms.pop(room_slug, None)
+        if old is not None:
+            self._bytes -= old.size
+        entry.size = sum(len(json.dumps(row, default=str)) for row in entry.rows)
+        self._rooms[room_slug] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._rooms:
+            _, evicted = self._rooms.popitem(last=False)
+            self._bytes -= evicted.size
+
+    def _drop(self, room_slug):
+        entry = self._rooms.pop(room_slug, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _patchable(self, room_slug, version):
+        """
+        The cached entry, if version is the one right after it: no other
+        write came in between, so patching it brings it up to version.
+        Otherwise the entry is dropped and None returned.
+        """
+        self._filling.pop(room_slug, None)
+        entry = self._rooms.get(room_slug)
+        if entry is None:
+            return None
+        if version is None or version != entry.version + 1:
+            self._drop(room_slug)
+            return None
+        return entry
+
+    def messages_saved(self, saved):
+        """New messages were committed; saved is a list of (room slug, Message)"""
+        by_room = {}
+        for room_slug, msg in saved:
+            if msg is not None:
+                by_room.setdefault(room_slug, []).append(msg)
+
+        for room_slug, messages in by_room.items():
+            version = self.versions.bump(room_slug)
+            with self._lock:
+                self._filling.pop(room_slug, None)
+                if room_slug not in self._rooms:
+                    continue
+            rows = MessageRowSerializer(messages, many=True).data
+            with self._lock:
+                entry = self._patchable(room_slug, version)
+                if entry is None:
+                    continue
+                if any(row['sender_id'] not in self._senders for row in rows):
+                    # A sender we have no profile for; refill on the next read
+                    self._drop(room_slug)
+                    continue
+                rows = entry.rows + [dict(row) for row in rows]
+                self._store(room_slug, RoomMessages(
+                    rows[-self.per_room:],
+                    entry.deleted_by,
+                    entry.complete and len(rows) <= self.per_room,
+                    version,
+                ))
+
+    def message_edited(self, room_slug, message_id, content):
+        version = self.versions.bump(room_slug)
+        with self._lock:
+            entry = self._patchable(room_slug, version)
+            if entry is None:
+                return
+            for row in entry.rows:
+                if row['id'] == message_id:
+                    row.update(content=content, is_edited=True)
+            entry.version = version
+
+    def messages_deleted(self, room_slug, message_ids):
+        """Messages were deleted for everyone"""
+        if not message_ids:
+            return
+        version = self.versions.bump(room_slug)
+        with self._lock:
+            entry = self._patchable(room_slug, version)
+            if entry is None:
+                return
+            message_ids = set(message_ids)
+            rows = [row for row in entry.rows if row['id'] not in message_ids]
+            if len(rows) == len(entry.rows):
+                entry.version = version
+            elif entry.complete:
+                self._store(room_slug, RoomMessages(rows, entry.deleted_by, True, version))
+            else:
+                # Older messages would have to move up into the page
+                self._drop(room_slug)
+
+    def messages_hidden(self, room_slug, user_id, message_ids):
+        """user_id deleted messages for themselves"""
+        if not message_ids:
+            return
+        version = self.versions.bump(room_slug)
+        with self._lock:
+            entry = self._patchable(room_slug, version)
+            if entry is None:
+                return
+            for message_id in message_ids:
+                entry.deleted_by.setdefault(message_id, set()).add(user_id)
+            entry.version = version
+
+    def messages_read(self, room_slug, reader_id):
+        """reader_id read every message in the room sent by someone else"""
+        version = self.versions.bump(room_slug)
+        with self._lock:
+            entry = self._patchable(room_slug, version)
+            if entry is None:
+                return
+            for row in entry.rows:
+                if row['sender_id'] != reader_id:
+                    row['is_read'] = True
+            entry.version = version
+
+    def forget_sender(self, user_id):
+        with self._lock:
+            self._senders.pop(user_id, None)
+
+    def presence_changed(self, changes):
+        """changes maps user id -> (is_online, last_seen or None)"""
+        last_seen_field = serializers.DateTimeField()
+        with self._lock:
+            for user_id, (is_online, last_seen) in changes.items():
+                sender = self._senders.get(user_id)
+                if sender is None:
+                    continue
+                # Copy, a response may still be rendering the old one
+                sender = dict(sender, is_online=is_online)
+                if last_seen is not None:
+                    sender['last_seen'] = last_seen_field.to_representation(last_seen)
+                self._senders[user_id] = sender
+
+    def invalidate(self, room_slug):
+        self.versions.bump(room_slug)
+        with self._lock:
+            self._filling.pop(room_slug, None)
+            self._drop(room_slug)
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+            self._senders.clear()
+            self._filling.clear()
+            self._bytes = 0
+
+
+recent_messages = RecentMessageCache(
+    max_bytes=getattr(settings, 'RECENT_MESSAGES_CACHE_BYTES', 32 * 1024 * 1024),
+)
@@ -4,6 +4,7 @@ from django.contrib.auth import get_user_model
 from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from urllib.parse import parse_qs
+from .auth_cache import UserSnapshot, token_cache
 
 User = get_user_model()
 
@@ -17,7 +18,9 @@ def get_user_from_token(token_string):
         
         # Get the user
         user = User.objects.get(id=user_id)
-        return user
+        snapshot = UserSnapshot.from_user(user)
+        token_cache.set(token_string, snapshot, access_token['exp'])
+        return snapshot
     except (InvalidToken, TokenError, User.DoesNotExist, KeyError) as e:
         print(f"Token authentication failed: {e}")
         return AnonymousUser()
@@ -40,8 +43,9 @@ class TokenAuthMiddleware:
         token = query_params.get('token', [None])[0]
         
         if token:
-            # Authenticate user with token
-            scope['user'] = await get_user_from_token(token)
+            # Authenticate user with token; reconnects with a token we have
+            # already verified are answered from the cache
+            scope['user'] = token_cache.get(token) or await get_user_from_token(token)
             print(f"WebSocket authenticated user: {scope['user']}")
         else:
             scope['user'] = AnonymousUser()
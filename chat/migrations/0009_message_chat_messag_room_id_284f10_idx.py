@@ -0,0 +1,19 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_seq_room_last_delete_seq_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['room', 'timestamp', 'id'], name='chat_messag_room_id_284f10_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def backfill_conversations(apps, schema_editor):
+    Room = apps.get_model('chat', 'Room')
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+
+    rows = []
+    for room in Room.objects.prefetch_related('participants'):
+        member_ids = {user.id for user in room.participants.all()}
+        for user_id in member_ids:
+            others = sorted(member_ids - {user_id})
+            visible = Message.objects.filter(room=room, is_deleted_everyone=False).exclude(deleted_by=user_id)
+            last_message = visible.order_by('-timestamp', '-id').first()
+            rows.append(Conversation(
+                user_id=user_id,
+                room=room,
+                other_user_id=others[0] if others else None,
+                last_message=last_message,
+                last_activity=last_message.timestamp if last_message else None,
+                unread_count=visible.filter(is_read=False).exclude(sender_id=user_id).count(),
+            ))
+    Conversation.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_conversation'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.1 on 2026-10-17 20:13
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def backfill_watermarks(apps, schema_editor):
+    # Mark-read used to set is_read on every message from the other
+    # members, so the newest such message is where the reader got to
+    Message = apps.get_model('chat', 'Message')
+    Conversation = apps.get_model('chat', 'Conversation')
+    for conversation in Conversation.objects.all():
+        newest_read = Message.objects.filter(
+            room_id=conversation.room_id,
+            is_read=True,
+        ).exclude(sender_id=conversation.user_id).aggregate(newest=Max('id'))['newest']
+        if newest_read:
+            conversation.last_read_id = newest_read
+            conversation.save(update_fields=['last_read_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_backfill_conversations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_read_id',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_watermarks, migrations.RunPython.noop),
+    ]
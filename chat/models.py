@@ -5,6 +5,9 @@ class Room(models.Model):
     name = models.CharField(max_length=255, blank=True)
     slug = models.SlugField(unique=True)
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='rooms')
+    # Sequence number of the newest delete-for-everyone; deleted rows are
+    # gone, so resuming from before this needs a full refetch
+    last_delete_seq = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -25,6 +28,8 @@ class Message(models.Model):
     is_deleted_everyone = models.BooleanField(default=False)
     deleted_by = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='deleted_messages', blank=True)
     is_edited = models.BooleanField(default=False)
+    # Room sequence number of the last event that created or edited this message
+    seq = models.BigIntegerField(null=True, blank=True)
     
     # Call-specific fields (only used when message_type='call')
     call_duration = models.IntegerField(null=True, blank=True, help_text='Call duration in seconds')
@@ -44,10 +49,40 @@ class Message(models.Model):
 
     class Meta:
         ordering = ('timestamp',)
+        indexes = [
+            models.Index(fields=['room', 'seq']),
+            # Keyset pagination of room history (see RoomMessageListView)
+            models.Index(fields=['room', 'timestamp', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.sender.username}: {self.content[:50]}"
 
+class Conversation(models.Model):
+    """
+    One row per (user, room): the user's view of the room for the
+    conversation list, kept up to date by chat.conversations.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='conversations', on_delete=models.CASCADE)
+    room = models.ForeignKey(Room, related_name='conversations', on_delete=models.CASCADE)
+    other_user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    # Newest message the user can see (not deleted for everyone or by them)
+    last_message = models.ForeignKey(Message, related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    last_activity = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    # Read watermark: id of the newest message the user has read. A message
+    # is read once any member other than its sender has read past it.
+    last_read_id = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'room')
+        indexes = [
+            models.Index(fields=['user', '-last_activity']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} in {self.room_id}"
+
 class FriendRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -0,0 +1,67 @@
+import asyncio
+
+from django.conf import settings
+
+from accounts.push import Push, push_dispatcher
+
+from .presence import presence
+
+
+class OfflinePushes:
+    """
+    Push notifications for room messages to members with no open socket
+    (members who are connected get the chat_notification event instead).
+
+    The first message to a member in a room is pushed at once. Messages
+    that follow within window seconds are collapsed into one more push
+    when the window closes: the message itself, or "N new messages". The
+    window stays open while messages keep coming, and nothing is sent if
+    the member connected meanwhile. Pushes carry the room as their tag, so
+    the later one replaces the first in the system tray.
+
+    Process-local: a burst spread over several workers makes one push per
+    worker.
+    """
+
+    def __init__(self, window=3.0):
+        self.window = window
+        # (room slug, user id) -> [messages since the last push, title, preview]
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def message_sent(self, room_slug, recipient_ids, title, preview):
+        for user_id in recipient_ids:
+            key = (room_slug, user_id)
+            if key not in self._pending and await presence.is_online(user_id):
+                continue
+            # Checked again: another message may have opened the window
+            # while we were asking about presence
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending[0] += 1
+                pending[1:] = [title, preview]
+            else:
+                self._pending[key] = [0, title, preview]
+                self._push(key, title, preview)
+                asyncio.ensure_future(self._send_later(key))
+
+    def _push(self, key, title, body):
+        room_slug, user_id = key
+        push_dispatcher.submit(Push(user_id, title=title, body=body, chat_id=room_slug))
+
+    async def _send_later(self, key):
+        while True:
+            await asyncio.sleep(self.window)
+            pending = self._pending[key]
+            if pending[0] == 0 or await presence.is_online(key[1]):
+                del self._pending[key]
+                return
+            # Read after the presence check, which may have let more in
+            count, title, preview = pending
+            pending[0] = 0
+            self._push(key, title, preview if count == 1 else f'{count} new messages')
+
+
+offline_pushes = OfflinePushes(window=getattr(settings, 'OFFLINE_PUSH_WINDOW', 3.0))
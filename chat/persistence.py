@@ -0,0 +1,169 @@
+import asyncio
+from collections import Counter
+from dataclasses import dataclass, field
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from . import conversations
+from .message_cache import recent_messages
+from .models import Message
+from .rooms import room_registry
+
+
+@dataclass
+class PendingMessage:
+    room_slug: str
+    sender_id: int
+    content: str
+    message_type: str
+    future: asyncio.Future
+    extra: dict = field(default_factory=dict)
+
+
+class MessageWriter:
+    """
+    Write-behind persistence for chat messages.
+
+    Consumers submit messages and broadcast straight away; pending messages
+    from every room are written together with bulk_create once the batch
+    window elapses or the batch is full. Each submit() returns a future that
+    resolves to the saved Message (or None if it could not be stored), or
+    raises if the database could not be written at all.
+    """
+
+    def __init__(self, window=0.02, max_batch=200):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        # room -> messages submitted but not committed yet (queued or in a
+        # batch being written)
+        self._unwritten = Counter()
+        self._loop = None
+        self._task = None
+        self._has_pending = None
+        self._batch_full = None
+
+    def _start(self, loop):
+        self._loop = loop
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = loop.create_task(self._run())
+
+    @property
+    def queue_depth(self):
+        return len(self._pending)
+
+    def has_unwritten(self, room_slug):
+        """Messages of the room are still on their way to the database"""
+        return self._unwritten.get(room_slug, 0) > 0
+
+    def submit(self, room_slug, sender_id, content, message_type='text', **extra):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._start(loop)
+
+        future = loop.create_future()
+        self._pending.append(PendingMessage(room_slug, sender_id, content, message_type, future, extra))
+        self._unwritten[room_slug] += 1
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+        return future
+
+    async def flush(self):
+        """Commit everything pending right now"""
+        while self._pending:
+            await self._commit_next_batch()
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._commit_next_batch()
+            except Exception as e:
+                # The writer must outlive a bad batch, or every later message hangs
+                print(f"Error in message writer: {e}")
+
+    async def _commit_next_batch(self):
+        batch = self._pending[:self.max_batch]
+        del self._pending[:self.max_batch]
+        if len(self._pending) < self.max_batch:
+            self._batch_full.clear()
+        if not self._pending:
+            self._has_pending.clear()
+        if not batch:
+            return
+
+        try:
+            await self._commit(batch)
+        finally:
+            for item in batch:
+                self._unwritten[item.room_slug] -= 1
+                if self._unwritten[item.room_slug] <= 0:
+                    del self._unwritten[item.room_slug]
+
+    async def _commit(self, batch):
+        try:
+            saved = await database_sync_to_async(self._write_batch)(batch)
+        except Exception as e:
+            print(f"Error saving message batch of {len(batch)}: {e}")
+            try:
+                saved = await database_sync_to_async(self._write_one_by_one)(batch)
+            except Exception as e:
+                print(f"Error saving messages one by one: {e}")
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                return
+
+        for item, msg in zip(batch, saved):
+            if not item.future.done():
+                item.future.set_result(msg)
+
+    def _build(self, item, room_id):
+        return Message(
+            room_id=room_id,
+            sender_id=item.sender_id,
+            content=item.content,
+            message_type=item.message_type,
+            **item.extra
+        )
+
+    def _write_batch(self, batch):
+        with transaction.atomic():
+            # Rooms and senders already in the registry cost no query, so a
+            # batch in known rooms is a single INSERT
+            messages = [self._build(item, room_registry.resolve(item.room_slug, item.sender_id)) for item in batch]
+            saved = Message.objects.bulk_create(messages)
+            conversations.messages_written(saved)
+        recent_messages.messages_saved([(item.room_slug, msg) for item, msg in zip(batch, saved)])
+        return saved
+
+    def _write_one_by_one(self, batch):
+        # A bad row (e.g. a sender that no longer exists) must not sink the
+        # rest of the batch, so retry each message on its own.
+        saved = []
+        for item in batch:
+            try:
+                with transaction.atomic():
+                    msg = self._build(item, room_registry.resolve(item.room_slug, item.sender_id))
+                    msg.save()
+                    conversations.messages_written([msg])
+                saved.append(msg)
+            except Exception as e:
+                print(f"Error saving message: {e}")
+                saved.append(None)
+        recent_messages.messages_saved([(item.room_slug, msg) for item, msg in zip(batch, saved)])
+        return saved
+
+
+message_writer = MessageWriter(
+    window=getattr(settings, 'MESSAGE_BATCH_WINDOW_MS', 20) / 1000,
+    max_batch=getattr(settings, 'MESSAGE_BATCH_SIZE', 200),
+)
@@ -0,0 +1,257 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from . import conversations
+from .message_cache import recent_messages
+
+User = get_user_model()
+
+
+class LocalPresenceStore:
+    """Open sockets per user for a single process"""
+
+    def __init__(self):
+        self._sockets = {}
+
+    async def add(self, user_id, socket_id):
+        sockets = self._sockets.setdefault(user_id, set())
+        sockets.add(socket_id)
+        return len(sockets)
+
+    async def remove(self, user_id, socket_id):
+        """(whether socket_id was registered, sockets left)"""
+        sockets = self._sockets.get(user_id, set())
+        removed = socket_id in sockets
+        sockets.discard(socket_id)
+        if not sockets:
+            self._sockets.pop(user_id, None)
+        return removed, len(sockets)
+
+    async def count(self, user_id):
+        return len(self._sockets.get(user_id, ()))
+
+    async def refresh(self, sockets):
+        pass
+
+
+class RedisPresenceStore:
+    """
+    Open sockets per user kept next to the user's group on the Redis channel
+    layer, so every worker sees the same count.
+
+    Each socket is a member of the user's sorted set, scored with the time
+    it expires: ttl seconds after its worker last refreshed it. Sockets of
+    a worker that died without running disconnect() stop counting once
+    they expire.
+    """
+
+    add_script = """
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        redis.call('ZADD', KEYS[1], ARGV[2], ARGV[3])
+        redis.call('EXPIRE', KEYS[1], ARGV[4])
+        return redis.call('ZCARD', KEYS[1])
+    """
+
+    remove_script = """
+        local removed = redis.call('ZREM', KEYS[1], ARGV[2])
+        redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+        local count = redis.call('ZCARD', KEYS[1])
+        if count == 0 then
+            redis.call('DEL', KEYS[1])
+        end
+        return {removed, count}
+    """
+
+    # Only sockets still registered are pushed forward: one removed while
+    # the refresh was on its way stays removed
+    refresh_script = """
+        for i = 3, #ARGV do
+            redis.call('ZADD', KEYS[1], 'XX', ARGV[1], ARGV[i])
+        end
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+    """
+
+    def __init__(self, layer, ttl=60):
+        self.layer = layer
+        self.ttl = ttl
+
+    def _key_and_connection(self, user_id):
+        name = f'presence_sockets_{user_id}'
+        return f'{self.layer.prefix}:{name}', self.layer.connection(self.layer.consistent_hash(name))
+
+    async def add(self, user_id, socket_id):
+        key, connection = self._key_and_connection(user_id)
+        now = time.time()
+        return await connection.eval(self.add_script, 1, key, now, now + self.ttl, socket_id, self.ttl)
+
+    async def remove(self, user_id, socket_id):
+        """(whether socket_id was registered, sockets left)"""
+        key, connection = self._key_and_connection(user_id)
+        removed, count = await connection.eval(self.remove_script, 1, key, time.time(), socket_id)
+        return bool(removed), count
+
+    async def count(self, user_id):
+        key, connection = self._key_and_connection(user_id)
+        return await connection.zcount(key, f'({time.time()}', '+inf')
+
+    async def refresh(self, sockets):
+        """sockets maps user id -> ids of the sockets this worker has open"""
+        expires_at = time.time() + self.ttl
+        for user_id, socket_ids in sockets.items():
+            key, connection = self._key_and_connection(user_id)
+            await connection.eval(self.refresh_script, 1, key, expires_at, self.ttl, *socket_ids)
+
+
+class PresenceTracker:
+    """
+    Tracks how many sockets (chat and notification) each user has open.
+
+    A user goes online on their first socket and offline when the last one
+    closes. is_online / last_seen changes are buffered and written in one
+    batch per flush interval; a disconnect followed by a reconnect inside
+    the interval writes nothing.
+
+    With the Redis store, a heartbeat refreshes this worker's sockets every
+    ttl / 3 seconds; those of a worker that stopped count for at most ttl
+    more seconds.
+    """
+
+    def __init__(self, flush_interval=2.0, ttl=60):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._store = None
+        # user_id -> ids of the sockets open in this process
+        self._sockets = {}
+        self._heartbeat_loop = None
+        self._heartbeat = None
+        # user_id -> (is_online, last_seen) waiting to be written
+        self._dirty = {}
+        # Users whose is_online=True has already been written by us
+        self._persisted_online = set()
+        self._loop = None
+        self._task = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            layer = get_channel_layer()
+            if hasattr(layer, 'connection'):
+                self._store = RedisPresenceStore(layer, self.ttl)
+            else:
+                self._store = LocalPresenceStore()
+        return self._store
+
+    @property
+    def queue_depth(self):
+        return len(self._dirty)
+
+    async def connect(self, user_id, socket_id):
+        """Register a socket (its channel name). Returns True if the user just came online"""
+        self._sockets.setdefault(user_id, set()).add(socket_id)
+        self._ensure_heartbeat()
+        came_online = await self.store.add(user_id, socket_id) == 1
+        if came_online:
+            self._mark(user_id, True, None)
+        return came_online
+
+    async def disconnect(self, user_id, socket_id):
+        """
+        Unregister a socket. Returns True if that was the user's last one;
+        a socket that was never registered (or already expired) changes
+        nothing.
+        """
+        sockets = self._sockets.get(user_id)
+        if sockets is not None:
+            sockets.discard(socket_id)
+            if not sockets:
+                del self._sockets[user_id]
+        removed, count = await self.store.remove(user_id, socket_id)
+        went_offline = removed and count == 0
+        if went_offline:
+            self._mark(user_id, False, timezone.now())
+        return went_offline
+
+    async def is_online(self, user_id):
+        return await self.store.count(user_id) > 0
+
+    def _mark(self, user_id, is_online, last_seen):
+        pending = self._dirty.get(user_id)
+        if is_online and pending is not None and user_id in self._persisted_online:
+            # Reconnected before the offline state was written
+            del self._dirty[user_id]
+        else:
+            self._dirty[user_id] = (is_online, last_seen)
+        self._ensure_flusher()
+
+    def _ensure_heartbeat(self):
+        loop = asyncio.get_running_loop()
+        if self._heartbeat_loop is not loop or self._heartbeat.done():
+            self._heartbeat_loop = loop
+            self._heartbeat = loop.create_task(self._beat())
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            if not self._sockets:
+                return
+            try:
+                await self.store.refresh({user_id: set(ids) for user_id, ids in self._sockets.items()})
+            except Exception as e:
+                print(f"Error refreshing presence: {e}")
+
+    def _ensure_flusher(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while self._dirty:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write all pending presence changes now"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        try:
+            await database_sync_to_async(self._write)(dirty)
+        except Exception as e:
+            print(f"Error flushing presence for {len(dirty)} users: {e}")
+            # Keep newer changes that arrived while we were writing
+            for user_id, state in dirty.items():
+                self._dirty.setdefault(user_id, state)
+            return
+
+        recent_messages.presence_changed(dirty)
+        for user_id, (is_online, _) in dirty.items():
+            if is_online:
+                self._persisted_online.add(user_id)
+            else:
+                self._persisted_online.discard(user_id)
+
+    def _write(self, dirty):
+        online_ids = [user_id for user_id, (is_online, _) in dirty.items() if is_online]
+        offline = [
+            User(id=user_id, is_online=False, last_seen=last_seen)
+            for user_id, (is_online, last_seen) in dirty.items()
+            if not is_online
+        ]
+        if online_ids:
+            User.objects.filter(id__in=online_ids).update(is_online=True)
+        if offline:
+            User.objects.bulk_update(offline, ['is_online', 'last_seen'])
+        conversations.friends_changed(list(dirty))
+
+
+presence = PresenceTracker(
+    flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 2.0),
+    ttl=getattr(settings, 'PRESENCE_TTL', 60),
+)
@@ -0,0 +1,76 @@
+import base64
+import json
+
+import msgpack
+
+# WebSocket subprotocols a client can offer in Sec-WebSocket-Protocol.
+# Clients that offer neither (every client before this existed) get JSON.
+MSGPACK_SUBPROTOCOL = 'msgpack'
+JSON_SUBPROTOCOL = 'json'
+
+
+def prepare_frames(data, binary_data=None):
+    """
+    Encode an outbound event once for both protocols, so a group broadcast
+    costs one encode however many sockets are in the room. binary_data
+    replaces data for MessagePack sockets when the two differ.
+    """
+    return {
+        'text': json.dumps(data),
+        'bytes': msgpack.packb(data if binary_data is None else binary_data, use_bin_type=True),
+    }
+
+
+class FrameCodecMixin:
+    """
+    Lets a consumer speak MessagePack binary frames or JSON text frames,
+    picked at connect time. Both carry exactly the same event dicts.
+    """
+
+    binary_frames = False
+
+    def select_subprotocol(self):
+        offered = self.scope.get('subprotocols') or []
+        if MSGPACK_SUBPROTOCOL in offered:
+            return MSGPACK_SUBPROTOCOL
+        if JSON_SUBPROTOCOL in offered:
+            return JSON_SUBPROTOCOL
+        return None
+
+    async def accept_negotiated(self):
+        subprotocol = self.select_subprotocol()
+        self.binary_frames = subprotocol == MSGPACK_SUBPROTOCOL
+        await self.accept(subprotocol=subprotocol)
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data, raw=False)
+        return json.loads(text_data)
+
+    async def send_event(self, data):
+        if self.binary_frames:
+            await self.send(bytes_data=msgpack.packb(data, use_bin_type=True))
+        else:
+            await self.send(text_data=json.dumps(data))
+
+    async def send_frames(self, frames):
+        """Write a frame built by prepare_frames() verbatim"""
+        if self.binary_frames:
+            await self.send(bytes_data=frames['bytes'])
+        else:
+            await self.send(text_data=frames['text'])
+
+    def decode_edit_content(self, value):
+        # JSON clients send edited text base64-encoded; binary frames carry it raw
+        if self.binary_frames:
+            return value
+        return base64.b64decode(value).decode('utf-8')
+
+    def encode_edit_content(self, value):
+        if self.binary_frames:
+            return value
+        return encode_edit_content(value)
+
+
+def encode_edit_content(value):
+    return base64.b64encode(value.encode('utf-8')).decode('ascii')
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from .models import Room
+
+User = get_user_model()
+
+RoomEntry = namedtuple('RoomEntry', ['room_id', 'participant_ids'])
+
+
+def slug_user_ids(room_slug):
+    """User ids named in a user1_user2 slug"""
+    user_ids = []
+    for uid in room_slug.split('_'):
+        try:
+            user_ids.append(int(uid))
+        except ValueError:
+            continue
+    return user_ids
+
+
+def get_room_for_message(room_slug, user_id):
+    """
+    Return the room a message from user_id goes into, creating it from the
+    user1_user2 slug and adding the sender as a participant when needed.
+    """
+    room, created = Room.objects.get_or_create(
+        slug=room_slug,
+        defaults={'name': room_slug}
+    )
+
+    # Add user as participant if not already added
+    if not room.participants.filter(id=user_id).exists():
+        room.participants.add(user_id)
+
+    # Extract other user ID from room name (format: user1_user2)
+    if created:
+        for other_id in slug_user_ids(room_slug):
+            if other_id != user_id and User.objects.filter(id=other_id).exists():
+                room.participants.add(other_id)
+
+    return room
+
+
+class RoomRegistry:
+    """
+    Process-local LRU of slug -> (room id, participant ids).
+
+    Lets the chat hot path skip the get_or_create / participant checks for
+    rooms it has already seen. Entries are dropped by the Room signals in
+    chat.signals whenever a room or its participants change.
+    """
+
+    def __init__(self, max_rooms=10000):
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with one
+        # does not put a stale entry back
+        self._version = 0
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def get(self, room_slug):
+        with self._lock:
+            entry = self._rooms.get(room_slug)
+            if entry is not None:
+                self._rooms.move_to_end(room_slug)
+            return entry
+
+    def _put(self, room_slug, entry, version):
+        with self._lock:
+            if version != self._version:
+                return
+            self._rooms[room_slug] = entry
+            self._rooms.move_to_end(room_slug)
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+
+    def load(self, room_slug):
+        """Fetch a room's entry from the database, caching it. Returns None if missing"""
+        version = self._version
+        room = Room.objects.filter(slug=room_slug).only('id').first()
+        if room is None:
+            return None
+        entry = RoomEntry(room.id, frozenset(room.participants.values_list('id', flat=True)))
+        self._put(room_slug, entry, version)
+        return entry
+
+    def resolve(self, room_slug, user_id):
+        """
+        Return the room id for a message from user_id, creating the room and
+        membership on a miss. A known room with a known sender costs no query.
+        """
+        entry = self.get(room_slug)
+        if entry is not None and user_id in entry.participant_ids:
+            return entry.room_id
+
+        room = get_room_for_message(room_slug, user_id)
+        version = self._version
+        entry = RoomEntry(room.id, frozenset(room.participants.values_list('id', flat=True)))
+        self._put(room_slug, entry, version)
+        return room.id
+
+    def invalidate(self, room_slug=None, room_id=None):
+        with self._lock:
+            self._version += 1
+            if room_slug is not None:
+                self._rooms.pop(room_slug, None)
+            if room_id is not None:
+                for slug, entry in list(self._rooms.items()):
+                    if entry.room_id == room_id:
+                        del self._rooms[slug]
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._rooms.clear()
+
+
+room_registry = RoomRegistry(max_rooms=getattr(settings, 'ROOM_REGISTRY_SIZE', 10000))
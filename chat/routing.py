@@ -4,4 +4,6 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r'ws/chat/(?P<room_name>\w+)/$', consumers.ChatConsumer.as_asgi()),
     re_path(r'ws/notify/', consumers.NotificationConsumer.as_asgi()),
+    # Single socket: notifications plus subscribe/unsubscribe to any rooms
+    re_path(r'ws/connect/$', consumers.MultiplexConsumer.as_asgi()),
 ]
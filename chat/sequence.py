@@ -0,0 +1,239 @@
+from collections import OrderedDict, deque
+from operator import itemgetter
+
+import msgpack
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db.models import Max
+
+from .conversations import apply_read_state
+from .models import Message, Room
+from .persistence import message_writer
+
+
+class LocalSequenceStore:
+    """Sequence counters and replay buffers for a single process"""
+
+    def __init__(self, buffer_size=256, max_rooms=10000):
+        self.buffer_size = buffer_size
+        self.max_rooms = max_rooms
+        # room -> [last seq, floor, deque of (seq, frames)]. Events at or
+        # below floor may have been dropped from the buffer.
+        self._rooms = OrderedDict()
+
+    async def seed(self, room, seq):
+        if room not in self._rooms:
+            self._rooms[room] = [seq, seq, deque()]
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+
+    async def incr(self, room):
+        """Next number for the room, or None if it has not been seeded"""
+        state = self._rooms.get(room)
+        if state is None:
+            return None
+        self._rooms.move_to_end(room)
+        state[0] += 1
+        return state[0]
+
+    async def append(self, room, seq, frames):
+        state = self._rooms.get(room)
+        if state is None:
+            return
+        buffer = state[2]
+        buffer.append((seq, frames))
+        while len(buffer) > self.buffer_size:
+            state[1] = max(state[1], buffer.popleft()[0])
+
+    async def replace(self, room, seq, frames):
+        """Swap the frames buffered for seq (drop them if frames is None)"""
+        state = self._rooms.get(room)
+        if state is None:
+            return
+        buffer = state[2]
+        for index in range(len(buffer) - 1, -1, -1):
+            if buffer[index][0] == seq:
+                if frames is None:
+                    del buffer[index]
+                else:
+                    buffer[index] = (seq, frames)
+                return
+
+    async def since(self, room, after_seq):
+        """(floor, [(seq, frames)]) for the buffered events after after_seq"""
+        state = self._rooms.get(room)
+        if state is None:
+            return None, []
+        return state[1], [event for event in state[2] if event[0] > after_seq]
+
+
+class RedisSequenceStore:
+    """
+    Counters and replay buffers kept on the Redis channel layer, next to the
+    room's group, so every worker hands out numbers from the same sequence
+    and can replay events sent through any other worker.
+    """
+
+    # Buffers of rooms that have been quiet this long go away
+    expiry = 86400
+
+    incr_script = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then
+            return redis.call('INCR', KEYS[1])
+        end
+        return false
+    """
+
+    append_script = """
+        redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+        local excess = redis.call('ZCARD', KEYS[2]) - tonumber(ARGV[3])
+        if excess > 0 then
+            local popped = redis.call('ZPOPMIN', KEYS[2], excess)
+            local dropped = tonumber(popped[#popped])
+            if dropped > tonumber(redis.call('GET', KEYS[3]) or '0') then
+                redis.call('SET', KEYS[3], dropped)
+            end
+        end
+        redis.call('EXPIRE', KEYS[2], ARGV[4])
+        redis.call('EXPIRE', KEYS[3], ARGV[4])
+    """
+
+    # Only events still in the buffer are swapped; an empty ARGV[2] drops
+    replace_script = """
+        local removed = redis.call('ZREMRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+        if removed > 0 and ARGV[2] ~= '' then
+            redis.call('ZADD', KEYS[1], ARGV[1], ARGV[2])
+        end
+    """
+
+    def __init__(self, layer, buffer_size=256):
+        self.layer = layer
+        self.buffer_size = buffer_size
+
+    def _keys_and_connection(self, room):
+        name = f'seq_{room}'
+        key = f'{self.layer.prefix}:{name}'
+        keys = (key, f'{key}:log', f'{key}:floor')
+        return keys, self.layer.connection(self.layer.consistent_hash(name))
+
+    async def seed(self, room, seq):
+        (counter, _, floor), connection = self._keys_and_connection(room)
+        await connection.set(counter, seq, nx=True)
+        await connection.set(floor, seq, nx=True, ex=self.expiry)
+
+    async def incr(self, room):
+        (counter, _, _), connection = self._keys_and_connection(room)
+        return await connection.eval(self.incr_script, 1, counter)
+
+    async def append(self, room, seq, frames):
+        keys, connection = self._keys_and_connection(room)
+        await connection.eval(
+            self.append_script, 3, *keys,
+            seq, msgpack.packb([seq, frames], use_bin_type=True), self.buffer_size, self.expiry
+        )
+
+    async def replace(self, room, seq, frames):
+        (_, log, _), connection = self._keys_and_connection(room)
+        entry = msgpack.packb([seq, frames], use_bin_type=True) if frames is not None else b''
+        await connection.eval(self.replace_script, 1, log, seq, entry)
+
+    async def since(self, room, after_seq):
+        (counter, log, floor_key), connection = self._keys_and_connection(room)
+        floor = await connection.get(floor_key)
+        if floor is None:
+            # The buffer expired: nothing up to the current number is kept
+            floor = await connection.get(counter)
+            if floor is None:
+                return None, []
+        entries = await connection.zrangebyscore(log, f'({after_seq}', '+inf')
+        return int(floor), [tuple(msgpack.unpackb(entry, raw=False)) for entry in entries]
+
+
+class RoomSequencer:
+    """
+    Hands out per-room sequence numbers for room events (messages, edits,
+    deletes, call logs) and keeps the newest events of each room so a
+    reconnecting client can be sent just what it missed.
+
+    Numbers only go up, but may skip (an edit that was refused still used
+    one). Counters start from the highest number stored in the database.
+    """
+
+    def __init__(self, buffer_size=256, max_rooms=10000, db_limit=500):
+        self.buffer_size = buffer_size
+        self.max_rooms = max_rooms
+        self.db_limit = db_limit
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            layer = get_channel_layer()
+            if hasattr(layer, 'connection'):
+                self._store = RedisSequenceStore(layer, self.buffer_size)
+            else:
+                self._store = LocalSequenceStore(self.buffer_size, self.max_rooms)
+        return self._store
+
+    async def next(self, room_slug):
+        seq = await self.store.incr(room_slug)
+        if seq is None:
+            await self.store.seed(room_slug, await database_sync_to_async(self.load_seed)(room_slug))
+            seq = await self.store.incr(room_slug)
+        return seq
+
+    async def record(self, room_slug, seq, frames):
+        """Keep an event's encoded frames for replay"""
+        await self.store.append(room_slug, seq, frames)
+
+    async def amend(self, room_slug, seq, frames):
+        """
+        Replace a buffered event's frames, e.g. once a message broadcast
+        before its write has an id; None drops the event (the write failed)
+        """
+        await self.store.replace(room_slug, seq, frames)
+
+    async def replay(self, room_slug, after_seq):
+        """
+        Buffered events after after_seq as (seq, frames), oldest first, or
+        None if the buffer does not reach back that far
+        """
+        floor, events = await self.store.since(room_slug, after_seq)
+        if floor is None or after_seq < floor:
+            return None
+        return sorted(events, key=itemgetter(0))
+
+    def load_seed(self, room_slug):
+        room = Room.objects.filter(slug=room_slug).values('id', 'last_delete_seq').first()
+        if room is None:
+            return 0
+        top = Message.objects.filter(room_id=room['id']).aggregate(top=Max('seq'))['top'] or 0
+        return max(top, room['last_delete_seq'])
+
+    def load_since(self, room_slug, after_seq):
+        """
+        Messages created or edited after after_seq, oldest first, and whether
+        that is everything the client missed. Deleted messages cannot be
+        replayed from the database, nor can more than db_limit messages, nor
+        messages the write-behind writer has not committed yet.
+        """
+        # Checked before the query: a message committed in between is read
+        unwritten = message_writer.has_unwritten(room_slug)
+        room = Room.objects.filter(slug=room_slug).values('id', 'last_delete_seq').first()
+        if room is None:
+            return [], True
+        messages = list(
+            Message.objects.filter(room_id=room['id'], seq__gt=after_seq).order_by('seq')[:self.db_limit + 1]
+        )
+        complete = len(messages) <= self.db_limit and room['last_delete_seq'] <= after_seq and not unwritten
+        messages = messages[:self.db_limit]
+        apply_read_state(messages)
+        return messages, complete
+
+
+room_sequencer = RoomSequencer(
+    buffer_size=getattr(settings, 'REPLAY_BUFFER_SIZE', 256),
+    max_rooms=getattr(settings, 'REPLAY_BUFFER_ROOMS', 10000),
+    db_limit=getattr(settings, 'REPLAY_DB_LIMIT', 500),
+)
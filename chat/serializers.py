@@ -1,20 +1,79 @@
+from django.db import models
 from rest_framework import serializers
 from .models import Room, Message, FriendRequest, BlockedUser
+from django.contrib.auth import get_user_model
 from accounts.serializers import UserSerializer
+from .conversations import apply_read_state
+
+User = get_user_model()
 
 class RoomSerializer(serializers.ModelSerializer):
     class Meta:
         model = Room
         fields = '__all__'
 
+class MessageRowSerializer(serializers.ModelSerializer):
+    """
+    The fields of MessageSerializer that depend only on the message row:
+    no sender profile and nothing specific to the viewer.
+    """
+    sender_id = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'room', 'sender_id', 'content', 'timestamp', 'is_read', 'message_type', 'is_deleted_everyone', 'is_edited', 'call_status', 'call_duration']
+
+
+class MessageListSerializer(serializers.ListSerializer):
+    """
+    Serializes a page of messages in a fixed number of queries: senders are
+    loaded and serialized once each, "deleted by me" is one set lookup and
+    is_read comes from the room's read watermarks.
+    """
+
+    def to_representation(self, data):
+        messages = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        if not messages:
+            return []
+
+        sender_ids = {msg.sender_id for msg in messages}
+        users = {msg.sender_id: msg.sender for msg in messages if Message.sender.is_cached(msg)}
+        missing = sender_ids - users.keys()
+        if missing:
+            users.update(User.objects.in_bulk(missing))
+        senders = {
+            user_id: UserSerializer(user, context=self.context).data
+            for user_id, user in users.items()
+        }
+
+        deleted = set()
+        request = self.context.get('request')
+        user = request.user if request else None
+        if user and user.is_authenticated:
+            deleted = set(Message.deleted_by.through.objects.filter(
+                message_id__in=[msg.id for msg in messages],
+                user_id=user.id,
+            ).values_list('message_id', flat=True))
+
+        apply_read_state(messages)
+        rows = MessageRowSerializer(messages, many=True).data
+        return [render_message(row, senders[row['sender_id']], row['id'] in deleted) for row in rows]
+
+
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
     sender_id = serializers.IntegerField(source='sender.id', read_only=True)
+    is_read = serializers.SerializerMethodField()
     is_deleted_by_me = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = ['id', 'room', 'sender', 'sender_id', 'content', 'timestamp', 'is_read', 'message_type', 'is_deleted_everyone', 'is_deleted_by_me', 'is_edited', 'call_status', 'call_duration']
+        list_serializer_class = MessageListSerializer
+
+    def get_is_read(self, obj):
+        apply_read_state([obj])
+        return obj.is_read
 
     def get_is_deleted_by_me(self, obj):
         user = self.context.get('request').user if self.context.get('request') else None
@@ -23,6 +82,18 @@ class MessageSerializer(serializers.ModelSerializer):
         return False
 
 
+def render_message(row, sender, deleted_by_me):
+    """MessageSerializer output from a MessageRowSerializer row and the sender's UserSerializer data"""
+    data = {}
+    for name in MessageSerializer.Meta.fields:
+        if name == 'sender':
+            data[name] = sender
+        elif name == 'is_deleted_by_me':
+            data[name] = deleted_by_me
+        else:
+            data[name] = row[name]
+    return data
+
 
 class FriendRequestSerializer(serializers.ModelSerializer):
     from_user = UserSerializer(read_only=True)
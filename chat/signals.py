@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from . import conversations
+from .auth_cache import token_cache
+from .blocks import block_index
+from .friends import friend_graph
+from .message_cache import recent_messages
+from .models import BlockedUser, FriendRequest, Room
+from .rooms import room_registry
+
+User = get_user_model()
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def room_participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Drop cached room entries whenever room membership changes"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        room_registry.invalidate(room_slug=instance.slug, room_id=instance.id)
+    elif pk_set:
+        for room_id in pk_set:
+            room_registry.invalidate(room_id=room_id)
+    else:
+        # user.rooms.clear(): we don't know which rooms were affected
+        room_registry.clear()
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def room_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep the conversation list rows in step with room membership"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        conversations.sync_members(instance.id)
+    elif pk_set:
+        for room_id in pk_set:
+            conversations.sync_members(room_id)
+    else:
+        conversations.remove_user(instance.id)
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def room_changed(sender, instance, **kwargs):
+    room_registry.invalidate(room_slug=instance.slug, room_id=instance.id)
+    recent_messages.invalidate(instance.slug)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Cached socket logins and message senders carry a snapshot of the user; rebuild it next time"""
+    token_cache.invalidate_user(instance.id)
+    recent_messages.forget_sender(instance.id)
+    conversations.friends_changed([instance.id])
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def friend_request_changed(sender, instance, **kwargs):
+    """Accepting, rejecting or blocking (which deletes requests) changes who is friends with whom"""
+    friend_graph.invalidate(instance.from_user_id, instance.to_user_id)
+
+
+@receiver(post_save, sender=BlockedUser)
+@receiver(post_delete, sender=BlockedUser)
+def block_changed(sender, instance, **kwargs):
+    block_index.invalidate(instance.blocker_id, instance.blocked_id)
@@ -0,0 +1,381 @@
+import asyncio
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import OperationalError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+
+from chat import routing
+from chat.blocks import BlockIndex
+from chat.consumers import ChatConsumer
+from chat.message_cache import RecentMessageCache, recent_messages
+from chat.middleware import TokenAuthMiddlewareStack
+from chat.models import BlockedUser, Message, Room
+from chat.offline_push import OfflinePushes
+from chat.persistence import MessageWriter, message_writer
+from chat.presence import LocalPresenceStore, PresenceTracker
+from chat.sequence import room_sequencer
+from chat.serializers import MessageSerializer
+
+User = get_user_model()
+
+application = TokenAuthMiddlewareStack(URLRouter(routing.websocket_urlpatterns))
+
+
+class BlockedChatTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'pw', username='alice')
+        self.bob = User.objects.create_user('bob@example.com', 'pw', username='bob')
+        BlockedUser.objects.create(blocker=self.bob, blocked=self.alice)
+        self.room_slug = f'{self.alice.id}_{self.bob.id}'
+
+    async def test_first_message_to_new_room_is_refused(self):
+        communicator = WebsocketCommunicator(
+            application, f'/ws/chat/{self.room_slug}/?token={AccessToken.for_user(self.alice)}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        # Alice's own "online" status
+        await communicator.receive_json_from()
+
+        await communicator.send_json_to({'message': 'hi', 'client_id': 'c1'})
+        self.assertEqual(await communicator.receive_json_from(), {
+            'type': 'error', 'error': 'Blocked', 'room': self.room_slug, 'client_id': 'c1',
+        })
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        self.assertFalse(await database_sync_to_async(Room.objects.filter(slug=self.room_slug).exists)())
+        self.assertEqual(await database_sync_to_async(Message.objects.count)(), 0)
+
+
+class BlockIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'pw', username='alice')
+        self.bob = User.objects.create_user('bob@example.com', 'pw', username='bob')
+
+    def test_block_reaches_other_workers_at_once(self):
+        # Another worker's index, sharing the Django cache with this one
+        other_worker = BlockIndex()
+        self.assertFalse(other_worker.is_blocked(self.alice.id, self.bob.id))
+
+        block = BlockedUser.objects.create(blocker=self.bob, blocked=self.alice)
+        with self.assertNumQueries(1):
+            self.assertTrue(other_worker.is_blocked(self.alice.id, self.bob.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(other_worker.is_blocked(self.alice.id, self.bob.id))
+
+        block.delete()
+        self.assertFalse(other_worker.is_blocked(self.alice.id, self.bob.id))
+
+
+class ResumeTests(TransactionTestCase):
+    def setUp(self):
+        room_sequencer._store = None
+        self.alice = User.objects.create_user('alice@example.com', 'pw', username='alice')
+        self.bob = User.objects.create_user('bob@example.com', 'pw', username='bob')
+        self.room_slug = f'{self.alice.id}_{self.bob.id}'
+
+    def connect(self, user, query=''):
+        return WebsocketCommunicator(application, f'/ws/chat/{self.room_slug}/?token={AccessToken.for_user(user)}{query}')
+
+    def test_database_replay_is_incomplete_while_messages_are_unwritten(self):
+        room = Room.objects.create(slug=self.room_slug, name=self.room_slug)
+        Message.objects.create(room=room, sender=self.alice, content='hi', seq=1)
+        self.assertEqual(room_sequencer.load_since(self.room_slug, 0)[1], True)
+        with mock.patch.object(message_writer, 'has_unwritten', return_value=True):
+            messages, complete = room_sequencer.load_since(self.room_slug, 0)
+        self.assertEqual(([msg.seq for msg in messages], complete), ([1], False))
+
+    async def test_empty_message_uses_no_seq(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()  # online status
+
+        await alice.send_json_to({'message': '', 'client_id': 'c0'})
+        self.assertTrue(await alice.receive_nothing())
+        await alice.send_json_to({'message': 'hi', 'client_id': 'c1'})
+        broadcast = await alice.receive_json_from()
+        self.assertEqual((broadcast['client_id'], broadcast['seq']), ('c1', 1))
+        await alice.receive_json_from(timeout=5)  # ack
+        await alice.disconnect()
+
+    async def test_replayed_message_carries_its_committed_id(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()  # online status
+
+        await alice.send_json_to({'message': 'hi', 'client_id': 'c1'})
+        broadcast = await alice.receive_json_from()
+        self.assertIsNone(broadcast['id'])
+        ack = await alice.receive_json_from(timeout=5)
+        self.assertEqual((ack['type'], ack['status']), ('message_ack', 'saved'))
+
+        bob = self.connect(self.bob, '&resume=0')
+        await bob.connect()
+        replayed = await bob.receive_json_from()
+        self.assertEqual(replayed['id'], ack['id'])
+        self.assertEqual(replayed['timestamp'], ack['timestamp'])
+        self.assertEqual((replayed['seq'], replayed['client_id']), (broadcast['seq'], 'c1'))
+        self.assertEqual((await bob.receive_json_from())['type'], 'resumed')
+
+        await bob.disconnect()
+        await alice.disconnect()
+
+
+class RecentMessagesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        recent_messages.clear()
+        self.alice = User.objects.create_user('alice@example.com', 'pw', username='alice')
+        self.bob = User.objects.create_user('bob@example.com', 'pw', username='bob')
+        self.room = Room.objects.create(slug=f'{self.alice.id}_{self.bob.id}', name='dm')
+        self.message = Message.objects.create(room=self.room, sender=self.alice, content='hi')
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def page(self):
+        return self.client.get(f'/api/chat/messages/{self.room.slug}/').json()
+
+    def test_edit_through_another_worker_refreshes_page_one(self):
+        self.page()
+        self.assertEqual(len(recent_messages), 1)
+
+        # Another worker's cache, sharing the Django cache with this one
+        other_worker = RecentMessageCache()
+        Message.objects.filter(id=self.message.id).update(content='edited', is_edited=True)
+        other_worker.message_edited(self.room.slug, self.message.id, 'edited')
+
+        self.assertEqual(self.page()[0]['content'], 'edited')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page()[0]['content'], 'edited')
+
+    def test_delete_bumps_the_version_once_committed(self):
+        self.page()
+        version = recent_messages.versions.get(self.room.slug)
+        delete_messages = ChatConsumer.__dict__['process_delete_messages'].func
+        with self.captureOnCommitCallbacks(execute=True):
+            delete_messages(None, self.alice, [self.message.id], 'everyone', self.room.slug)
+            # A page read before the commit must not get the new version
+            self.assertEqual(recent_messages.versions.get(self.room.slug), version)
+
+        self.assertEqual(recent_messages.versions.get(self.room.slug), version + 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page(), [])
+
+    def test_own_writes_keep_the_page_cached(self):
+        self.page()
+        Message.objects.filter(id=self.message.id).update(content='edited', is_edited=True)
+        recent_messages.message_edited(self.room.slug, self.message.id, 'edited')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.page()[0]['content'], 'edited')
+
+
+class HistoryQueryTests(TestCase):
+    """A page costs the same number of queries whatever its size and number of senders"""
+
+    def setUp(self):
+        cache.clear()
+        recent_messages.clear()
+        self.users = [User.objects.create_user(f'user{i}@example.com', 'pw', username=f'user{i}') for i in range(3)]
+        self.room = Room.objects.create(slug=f'{self.users[0].id}_{self.users[1].id}', name='dm')
+        self.messages = [
+            Message.objects.create(room=self.room, sender=self.users[i % 3], content=str(i)) for i in range(101)
+        ]
+        for msg in self.messages[::3]:
+            msg.deleted_by.add(self.users[1], self.users[2])
+        self.reader = self.users[1]
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def test_serializer(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.reader
+        for size in (1, 40, 100):
+            with self.subTest(size=size):
+                messages = list(Message.objects.filter(room=self.room).order_by('id')[:size])
+                # Senders, the reader's deleted_by rows, read watermarks
+                with self.assertNumQueries(3):
+                    data = MessageSerializer(messages, many=True, context={'request': request}).data
+                self.assertEqual(len(data), size)
+                self.assertEqual({row['sender']['username'] for row in data}, {user.username for user in self.users[:size]})
+                self.assertEqual([row['is_deleted_by_me'] for row in data], [i % 3 == 0 for i in range(size)])
+
+    def test_keyset_pages(self):
+        for size in (1, 40, 100):
+            with self.subTest(size=size):
+                url = f'/api/chat/messages/{self.room.slug}/?before={self.messages[size].id}&limit={size}'
+                # The room, the messages, then the serializer's three
+                with self.assertNumQueries(5):
+                    data = self.client.get(url).json()
+                self.assertEqual([row['id'] for row in data], [msg.id for msg in self.messages[:size]])
+
+    def test_first_page(self):
+        url = f'/api/chat/messages/{self.room.slug}/'
+        # The room, the messages, the serializer's three, and every
+        # deleted_by row of the page for the cache
+        with self.assertNumQueries(6):
+            data = self.client.get(url).json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).json(), data)
+        self.assertEqual([row['id'] for row in data], [msg.id for msg in self.messages[-40:]])
+
+
+class OfflinePushTests(SimpleTestCase):
+    window = 0.05
+
+    def setUp(self):
+        self.online = set()
+        self.pushes = []
+        dispatcher = mock.patch('chat.offline_push.push_dispatcher')
+        self.addCleanup(dispatcher.stop)
+        dispatcher.start().submit.side_effect = self.pushes.append
+        is_online = mock.patch('chat.offline_push.presence.is_online', side_effect=self.is_online)
+        self.addCleanup(is_online.stop)
+        is_online.start()
+        self.offline_pushes = OfflinePushes(window=self.window)
+
+    async def is_online(self, user_id):
+        return user_id in self.online
+
+    def sent(self):
+        return [(push.receiver_id, push.title, push.body, push.chat_id) for push in self.pushes]
+
+    async def wait_windows(self, count=1):
+        await asyncio.sleep(self.window * count + 0.02)
+
+    async def test_first_message_is_pushed_at_once(self):
+        await self.offline_pushes.message_sent('1_2', [2], 'alice', 'hi')
+        self.assertEqual(self.sent(), [('2', 'alice', 'hi', '1_2')])
+        await self.wait_windows()
+        self.assertEqual(len(self.pushes), 1)
+        self.assertEqual(len(self.offline_pushes), 0)
+
+    async def test_burst_is_collapsed(self):
+        for n in range(20):
+            await self.offline_pushes.message_sent('1_2', [2], 'alice', f'message {n}')
+        await self.wait_windows(2)
+        self.assertEqual(self.sent(), [
+            ('2', 'alice', 'message 0', '1_2'),
+            ('2', 'alice', '19 new messages', '1_2'),
+        ])
+
+    async def test_single_follow_up_shows_the_message(self):
+        await self.offline_pushes.message_sent('1_2', [2], 'alice', 'hi')
+        await self.offline_pushes.message_sent('1_2', [2], 'alice', 'are you there?')
+        await self.wait_windows(2)
+        self.assertEqual([push.body for push in self.pushes], ['hi', 'are you there?'])
+
+    async def test_online_recipients_get_no_push(self):
+        self.online.add(3)
+        await self.offline_pushes.message_sent('1_2_3', [2, 3], 'alice', 'hi')
+        self.assertEqual([push.receiver_id for push in self.pushes], ['2'])
+
+    async def test_no_follow_up_once_the_recipient_connects(self):
+        await self.offline_pushes.message_sent('1_2', [2], 'alice', 'hi')
+        await self.offline_pushes.message_sent('1_2', [2], 'alice', 'hello?')
+        self.online.add(2)
+        await self.wait_windows()
+        self.assertEqual([push.body for push in self.pushes], ['hi'])
+        self.assertEqual(len(self.offline_pushes), 0)
+
+
+class MessageWriterTests(SimpleTestCase):
+    async def test_writer_survives_a_failed_batch(self):
+        writer = MessageWriter(window=0)
+        failure = OperationalError('database is down')
+        with mock.patch.object(writer, '_write_batch', side_effect=failure), \
+                mock.patch.object(writer, '_write_one_by_one', side_effect=failure):
+            with self.assertRaises(OperationalError):
+                await asyncio.wait_for(writer.submit('1_2', 1, 'lost'), 1)
+
+        with mock.patch.object(writer, '_write_batch', side_effect=lambda batch: ['saved'] * len(batch)):
+            self.assertEqual(await asyncio.wait_for(writer.submit('1_2', 1, 'hi'), 1), 'saved')
+
+    async def test_messages_are_unwritten_until_committed(self):
+        writer = MessageWriter(window=0)
+        seen_while_writing = []
+
+        def write_batch(batch):
+            seen_while_writing.append(writer.has_unwritten('1_2'))
+            return ['saved'] * len(batch)
+
+        with mock.patch.object(writer, '_write_batch', side_effect=write_batch):
+            future = writer.submit('1_2', 1, 'hi')
+            self.assertTrue(writer.has_unwritten('1_2'))
+            self.assertFalse(writer.has_unwritten('1_3'))
+            await asyncio.wait_for(future, 1)
+        self.assertEqual(seen_while_writing, [True])
+        self.assertFalse(writer.has_unwritten('1_2'))
+
+
+class FailedWriteTests(TransactionTestCase):
+    def setUp(self):
+        room_sequencer._store = None
+        self.alice = User.objects.create_user('alice@example.com', 'pw', username='alice')
+        self.bob = User.objects.create_user('bob@example.com', 'pw', username='bob')
+        self.room_slug = f'{self.alice.id}_{self.bob.id}'
+
+    async def test_sender_is_told_the_write_failed(self):
+        failure = OperationalError('database is down')
+        alice = WebsocketCommunicator(application, f'/ws/chat/{self.room_slug}/?token={AccessToken.for_user(self.alice)}')
+        await alice.connect()
+        await alice.receive_json_from()  # online status
+
+        with mock.patch.object(message_writer, '_write_batch', side_effect=failure), \
+                mock.patch.object(message_writer, '_write_one_by_one', side_effect=failure):
+            await alice.send_json_to({'message': 'hi', 'client_id': 'c1'})
+            await alice.receive_json_from()  # the broadcast
+            ack = await alice.receive_json_from(timeout=5)
+        self.assertEqual((ack['type'], ack['client_id'], ack['status']), ('message_ack', 'c1', 'failed'))
+        await alice.disconnect()
+
+
+class PresenceTests(SimpleTestCase):
+    def setUp(self):
+        self.tracker = PresenceTracker(flush_interval=60, ttl=60)
+        self.tracker._store = LocalPresenceStore()
+
+    def tearDown(self):
+        for task in (self.tracker._task, self.tracker._heartbeat):
+            if task is not None:
+                task.cancel()
+
+    async def test_last_socket_takes_the_user_offline(self):
+        self.assertTrue(await self.tracker.connect(1, 'chat'))
+        self.assertFalse(await self.tracker.connect(1, 'notifications'))
+        self.assertFalse(await self.tracker.disconnect(1, 'chat'))
+        self.assertTrue(await self.tracker.is_online(1))
+        self.assertTrue(await self.tracker.disconnect(1, 'notifications'))
+        self.assertFalse(await self.tracker.is_online(1))
+
+    async def test_unmatched_disconnect_changes_nothing(self):
+        # e.g. a socket refused before it registered
+        self.assertFalse(await self.tracker.disconnect(1, 'never-connected'))
+        self.assertEqual(self.tracker.queue_depth, 0)
+
+        await self.tracker.connect(1, 'chat')
+        self.assertTrue(await self.tracker.disconnect(1, 'chat'))
+        self.assertFalse(await self.tracker.disconnect(1, 'chat'))
+        self.assertTrue(await self.tracker.connect(1, 'chat'))
+
+    async def test_heartbeat_refreshes_open_sockets(self):
+        self.tracker.ttl = 0.03
+        refreshed = []
+        with mock.patch.object(self.tracker._store, 'refresh', side_effect=lambda sockets: refreshed.append(sockets)):
+            await self.tracker.connect(1, 'chat')
+            await asyncio.sleep(0.025)
+            await self.tracker.disconnect(1, 'chat')
+            await asyncio.sleep(0.025)
+        self.assertTrue(refreshed)
+        self.assertEqual(refreshed[-1], {1: {'chat'}})
+        self.assertTrue(self.tracker._heartbeat.done())
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+from django.conf import settings
+
+
+class TypingState:
+    __slots__ = ('announced_at', 'timer')
+
+    def __init__(self, announced_at):
+        self.announced_at = announced_at
+        self.timer = None
+
+
+class TypingTracker:
+    """
+    Collapses per-keystroke typing frames into start/stop edges.
+
+    The room hears "typing" when a user starts, again at most once per
+    reannounce_interval while they keep going (so late joiners catch up),
+    and "stopped" when they say so or go quiet for expiry seconds.
+    """
+
+    def __init__(self, reannounce_interval=3.0, expiry=6.0):
+        self.reannounce_interval = reannounce_interval
+        self.expiry = expiry
+        # (room, user_id) -> TypingState
+        self._state = {}
+
+    def __len__(self):
+        return len(self._state)
+
+    async def update(self, room, user_id, is_typing, announce):
+        """
+        Record a typing frame. announce(is_typing) is awaited for every edge
+        that should reach the room.
+        """
+        key = (room, user_id)
+        state = self._state.get(key)
+
+        if not is_typing:
+            if state is not None:
+                self._clear(key)
+                await announce(False)
+            return
+
+        now = time.monotonic()
+        if state is None:
+            state = self._state[key] = TypingState(now)
+            await announce(True)
+        elif now - state.announced_at >= self.reannounce_interval:
+            state.announced_at = now
+            await announce(True)
+
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(self.expiry, self._expire, key, announce)
+
+    async def stop(self, room, user_id, announce):
+        """Announce a stop if the user is still marked as typing (e.g. on disconnect)"""
+        await self.update(room, user_id, False, announce)
+
+    def _clear(self, key):
+        state = self._state.pop(key, None)
+        if state is not None and state.timer is not None:
+            state.timer.cancel()
+
+    def _expire(self, key, announce):
+        if key in self._state:
+            del self._state[key]
+            asyncio.ensure_future(announce(False))
+
+
+typing_tracker = TypingTracker(
+    reannounce_interval=getattr(settings, 'TYPING_REANNOUNCE_INTERVAL', 3.0),
+    expiry=getattr(settings, 'TYPING_EXPIRY', 6.0),
+)
@@ -2,6 +2,7 @@ from django.urls import path
 from . import views
 from . import views_upload
 from .views_conversations import ConversationListView, MarkMessagesReadView
+from .views_stats import RealtimeStatsView
 
 urlpatterns = [
     # Friend Requests
@@ -27,4 +28,7 @@ urlpatterns = [
     # Media Upload
     # Media Upload
     path('upload/audio/', views_upload.AudioUploadView.as_view(), name='audio_upload'),
+
+    # Realtime internals (queue depths, counters) for staff
+    path('stats/realtime/', RealtimeStatsView.as_view(), name='realtime_stats'),
 ]
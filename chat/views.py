@@ -2,10 +2,13 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
+from django.db.models import Q, Subquery
 from django.contrib.auth import get_user_model
 from .models import FriendRequest, BlockedUser, Room, Message
 from .serializers import FriendRequestSerializer, BlockedUserSerializer, RoomSerializer, MessageSerializer
+from .blocks import block_index
+from .friends import friend_graph
+from .message_cache import HISTORY_PAGE_SIZE, recent_messages
 from accounts.serializers import UserSerializer
 
 User = get_user_model()
@@ -28,11 +31,12 @@ class SendFriendRequestView(APIView):
             return Response({'error': 'Cannot send friend request to yourself'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check if blocked
-        if BlockedUser.objects.filter(Q(blocker=request.user, blocked=to_user) | Q(blocker=to_user, blocked=request.user)).exists():
+        if block_index.is_blocked(request.user.id, to_user.id):
             return Response({'error': 'Cannot send friend request'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Check if request already exists
-        if FriendRequest.objects.filter(from_user=request.user, to_user=to_user).exists():
+        # Check if request already exists (friends always have one both ways)
+        if friend_graph.are_friends(request.user.id, to_user.id) or \
+                FriendRequest.objects.filter(from_user=request.user, to_user=to_user).exists():
             return Response({'error': 'Friend request already sent'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Check if reverse request exists (they sent you a request)
@@ -94,19 +98,8 @@ class FriendsListView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        # Get accepted friend requests
-        friend_requests = FriendRequest.objects.filter(
-            Q(from_user=request.user, status='accepted') | Q(to_user=request.user, status='accepted')
-        )
-        
-        # Extract unique friend user IDs
-        friend_ids = set()
-        for fr in friend_requests:
-            if fr.from_user == request.user:
-                friend_ids.add(fr.to_user.id)
-            else:
-                friend_ids.add(fr.from_user.id)
-        
+        # Friend ids come from the adjacency cache; the users in one query
+        friend_ids = friend_graph.friends(request.user.id)
         friends = User.objects.filter(id__in=friend_ids)
         return Response(UserSerializer(friends, many=True, context={'request': request}).data)
 
@@ -149,16 +142,48 @@ class BlockedUsersListView(APIView):
         blocked_users = BlockedUser.objects.filter(blocker=request.user)
         return Response(BlockedUserSerializer(blocked_users, many=True, context={'request': request}).data)
 
+def messages_before(room, before_id, limit):
+    """
+    The limit newest messages of room older than message before_id, newest
+    first. Seeks on the (room, timestamp, id) index, so every page costs
+    the same however far back it is.
+    """
+    before = Message.objects.filter(id=before_id, room=room)
+    before_timestamp = Subquery(before.values('timestamp')[:1])
+    # timestamp <= t bounds the index range; ties on t are cut by id
+    return Message.objects.filter(room=room, timestamp__lte=before_timestamp).exclude(
+        timestamp=before_timestamp, id__gte=before_id
+    ).order_by('-timestamp', '-id')[:limit]
+
+
 class RoomMessageListView(APIView):
+    """
+    Room history, oldest -> newest within a page.
+
+    ?before=<message id>&limit=<n> returns the messages just older than
+    that message; pass the first id of a page to get the one before it.
+    ?page=<n> (OFFSET pages of 40) still works.
+    """
     permission_classes = [IsAuthenticated]
+    max_limit = 100
 
     def get(self, request, room_slug):
+        if 'before' in request.query_params:
+            return self.get_before(request, room_slug)
+
         try:
             page = int(request.query_params.get('page', 1))
-            page_size = 40
+            page_size = HISTORY_PAGE_SIZE
             start = (page - 1) * page_size
             end = page * page_size
 
+            # Page 1 of an active room is served from memory
+            if page == 1:
+                cached = recent_messages.page(room_slug, request.user.id)
+                if cached is not None:
+                    return Response(cached)
+                fill_token = recent_messages.begin_fill(room_slug)
+
             room = Room.objects.get(slug=room_slug)
             
             # Fetch messages ordered by newest first, then slice
@@ -167,11 +192,36 @@ class RoomMessageListView(APIView):
             # Reverse to return in chronological order (Oldest -> Newest)
             # This allows the frontend to simply append/prepend correctly
             messages_list = list(messages)[::-1]
+            data = MessageSerializer(messages_list, many=True, context={'request': request}).data
+
+            if page == 1:
+                deleted_by = {}
+                hidden = Message.deleted_by.through.objects.filter(message_id__in=[msg.id for msg in messages_list])
+                for message_id, user_id in hidden.values_list('message_id', 'user_id'):
+                    deleted_by.setdefault(message_id, set()).add(user_id)
+                recent_messages.fill(room_slug, fill_token, data, deleted_by, complete=len(messages_list) < page_size)
             
-            return Response(MessageSerializer(messages_list, many=True, context={'request': request}).data)
+            return Response(data)
         except Room.DoesNotExist:
             return Response([])
 
+    def get_before(self, request, room_slug):
+        try:
+            before_id = int(request.query_params['before'])
+            limit = min(int(request.query_params.get('limit', HISTORY_PAGE_SIZE)), self.max_limit)
+        except ValueError:
+            return Response({'error': 'before and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            room = Room.objects.get(slug=room_slug)
+        except Room.DoesNotExist:
+            return Response([])
+
+        messages_list = list(messages_before(room, before_id, limit))[::-1]
+        return Response(MessageSerializer(messages_list, many=True, context={'request': request}).data)
+
 import os
 import uuid
 from django.conf import settings
@@ -1,80 +1,95 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q, Max, Count, Case, When, IntegerField
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.pagination import CursorPagination
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from django.conf import settings
+from django.db.models import Q, Max, Count, Case, When, IntegerField, OuterRef, Subquery
 from django.contrib.auth import get_user_model
-from .models import Room, Message, FriendRequest
+from .models import Room, FriendRequest, Conversation
+from .conversations import list_versions, room_read
+from .message_cache import recent_messages
 from accounts.serializers import UserSerializer
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 
 User = get_user_model()
 
+
+class ConversationPagination(CursorPagination):
+    ordering = ('-last_activity', '-id')
+    page_size = 20
+    page_size_query_param = 'limit'
+    max_page_size = getattr(settings, 'CONVERSATION_PAGE_MAX', 100)
+
+
 class ConversationListView(APIView):
+    """
+    Conversations of the current user, most recent activity first.
+
+    The whole list by default, or pages of ?limit= rooms followed through
+    ?cursor=. Responses carry the user's list version as their ETag; a
+    request whose If-None-Match still matches gets a 304.
+    """
     permission_classes = [IsAuthenticated]
+    # The JWT alone identifies the user, so a 304 costs no queries at all
+    authentication_classes = [JWTStatelessUserAuthentication, TokenAuthentication, SessionAuthentication]
     
     def get(self, request):
         """
         Get list of conversations with last message, unread count, and timestamp
         """
-        user = request.user
-        
-        # Get all rooms where user is a participant
-        rooms = Room.objects.filter(participants=user)
+        user_id = int(request.user.id)
+        # Read before the rows: a change in between moves the version past
+        # this ETag, so the next request gets a fresh list
+        etag = f'"{list_versions.get(user_id)}"'
+        if_none_match = request.headers.get('If-None-Match', '')
+        if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]:
+            return Response(status=304, headers={'ETag': etag})
+
+        # One row per room, kept current as messages are written, read
+        # and deleted (see chat.conversations)
+        friend_read = Conversation.objects.filter(room=OuterRef('room'), user=OuterRef('other_user'))
+        rows = Conversation.objects.filter(
+            user_id=user_id,
+            other_user__isnull=False,
+            last_message__isnull=False,
+        ).select_related('room', 'other_user', 'last_message').annotate(
+            friend_last_read_id=Subquery(friend_read.values('last_read_id')[:1])
+        ).order_by('-last_activity', '-id')
+
+        paginator = None
+        if 'limit' in request.query_params or 'cursor' in request.query_params:
+            paginator = ConversationPagination()
+            rows = paginator.paginate_queryset(rows, request, view=self)
         
         conversations = []
-        
-        for room in rooms:
-            # Get the other participant (friend)
-            other_user = room.participants.exclude(id=user.id).first()
-            if not other_user:
-                continue
-            
-            # Get last message in this room (excluding deleted messages)
-            # Exclude messages deleted for everyone OR deleted by current user
-            last_message = Message.objects.filter(
-                room=room,
-                is_deleted_everyone=False  # Not deleted for everyone
-            ).exclude(
-                deleted_by=user  # Not deleted by me
-            ).order_by('-timestamp').first()
-            
-            if not last_message:
-                continue  # Skip rooms with no messages
-            
-            # Count unread messages (messages sent by other user that current user hasn't read)
-            # Also exclude deleted messages from unread count
-            unread_count = Message.objects.filter(
-                room=room,
-                sender=other_user,
-                is_read=False,
-                is_deleted_everyone=False
-            ).exclude(
-                deleted_by=user
-            ).count()
-            
-            # Build conversation data
-            conversation = {
-                'room_slug': room.slug,
-                'friend': UserSerializer(other_user, context={'request': request}).data,
+        for row in rows:
+            last_message = row.last_message
+            # Read by whoever didn't send it (watermarks, see Conversation)
+            if last_message.sender_id == user_id:
+                is_read = last_message.id <= (row.friend_last_read_id or 0)
+            else:
+                is_read = last_message.id <= row.last_read_id
+            conversations.append({
+                'room_slug': row.room.slug,
+                'friend': UserSerializer(row.other_user, context={'request': request}).data,
                 'last_message': {
                     'id': last_message.id,  # Add message ID for filtering
                     'content': last_message.content,
                     'message_type': last_message.message_type,
                     'timestamp': last_message.timestamp,
-                    'sender_id': last_message.sender.id,
-                    'is_read': last_message.is_read,
+                    'sender_id': last_message.sender_id,
+                    'is_read': is_read,
                     'is_edited': last_message.is_edited,
                 },
-                'unread_count': unread_count,
-            }
-            
-            conversations.append(conversation)
-        
-        # Sort by last message timestamp (most recent first)
-        conversations.sort(key=lambda x: x['last_message']['timestamp'], reverse=True)
+                'unread_count': row.unread_count,
+            })
         
-        return Response(conversations)
+        response = paginator.get_paginated_response(conversations) if paginator else Response(conversations)
+        response['ETag'] = etag
+        return response
 
 
 class MarkMessagesReadView(APIView):
@@ -87,13 +102,10 @@ class MarkMessagesReadView(APIView):
         try:
             room = Room.objects.get(slug=room_slug, participants=request.user)
             
-            # Mark all unread messages from other users as read
-            Message.objects.filter(
-                room=room,
-                is_read=False
-            ).exclude(
-                sender=request.user
-            ).update(is_read=True)
+            # Move the reader's watermark to the newest message: one row,
+            # however many messages were unread
+            room_read(room.id, request.user.id)
+            recent_messages.messages_read(room_slug, request.user.id)
             
             # Broadcast read status
             channel_layer = get_channel_layer()
@@ -102,6 +114,7 @@ class MarkMessagesReadView(APIView):
                 room_group_name,
                 {
                     'type': 'read_status_update',
+                    'room': room_slug,
                     'reader_id': request.user.id
                 }
             )
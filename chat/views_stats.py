@@ -0,0 +1,18 @@
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework.permissions import IsAdminUser
+from .persistence import message_writer
+from .presence import presence
+
+
+class RealtimeStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        """
+        Queue depths and counters of this worker process
+        """
+        return Response({
+            'message_writer': {'queue_depth': message_writer.queue_depth},
+            'presence': {'queue_depth': presence.queue_depth},
+        })
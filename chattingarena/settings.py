@@ -113,22 +113,128 @@ TEMPLATES = [
 WSGI_APPLICATION = 'chattingarena.wsgi.application'
 ASGI_APPLICATION = 'chattingarena.asgi.application'
 
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
-        # For production on Render.com, use Redis:
-        # 'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        # 'CONFIG': {
-        #     "hosts": [os.environ.get('REDIS_URL', 'redis://localhost:6379')],
-        # },
-    },
-}
-
-# NOTE: For Render.com production, you need to:
-# 1. Add a Redis instance on Render.com
-# 2. Set REDIS_URL environment variable  
-# 3. Uncomment the Redis backend above
-# For now, InMemoryChannelLayer works for single-instance deployments
+# Channel layer mode:
+#   memory - InMemoryChannelLayer, single Daphne process only
+#   redis  - sharded Redis layer, REDIS_URL may hold several comma-separated
+#            hosts; chat_<room> and user_<id> groups are spread over them
+#            with a consistent hash ring
+#   local  - in-process fake of the sharded Redis layer, for load-testing
+#            multi-worker fan-out on one box (see `manage.py bench_fanout`)
+REDIS_URLS = [url.strip() for url in os.environ.get('REDIS_URL', '').split(',') if url.strip()]
+CHANNEL_LAYER_MODE = os.environ.get('CHANNEL_LAYER_MODE', 'redis' if REDIS_URLS else 'memory')
+
+if CHANNEL_LAYER_MODE == 'redis':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.ShardedRedisChannelLayer',
+            'CONFIG': {
+                'hosts': REDIS_URLS or ['redis://localhost:6379'],
+                'capacity': 1500,
+                'expiry': 10,
+            },
+        },
+    }
+elif CHANNEL_LAYER_MODE == 'local':
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'chat.layers.LocalShardedChannelLayer',
+            'CONFIG': {
+                'hosts': [f'local://shard{i}' for i in range(int(os.environ.get('LOCAL_LAYER_SHARDS', 4)))],
+                'capacity': 1500,
+                'expiry': 10,
+            },
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+# Cache for small shared state such as conversation list versions (ETags):
+# the first Redis host when there is one, so every worker sees the same
+# values, otherwise per-process memory
+if REDIS_URLS:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URLS[0],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Write-behind message persistence: chat messages are broadcast immediately
+# and committed together in bulk once the window elapses or the batch fills
+MESSAGE_BATCH_WINDOW_MS = int(os.environ.get('MESSAGE_BATCH_WINDOW_MS', 20))
+MESSAGE_BATCH_SIZE = int(os.environ.get('MESSAGE_BATCH_SIZE', 200))
+
+# Rooms (slug -> id + participant ids) kept in the per-process LRU registry
+ROOM_REGISTRY_SIZE = int(os.environ.get('ROOM_REGISTRY_SIZE', 10000))
+
+# Seconds between batched is_online / last_seen writes from the presence tracker
+PRESENCE_FLUSH_INTERVAL = float(os.environ.get('PRESENCE_FLUSH_INTERVAL', 2.0))
+# Sockets of a worker that stopped without closing them keep their user
+# online for at most this many seconds (live workers refresh theirs)
+PRESENCE_TTL = int(os.environ.get('PRESENCE_TTL', 60))
+
+# Typing indicators: minimum seconds between re-announcing an ongoing
+# "typing" to the room, and seconds of silence before it is cleared
+TYPING_REANNOUNCE_INTERVAL = float(os.environ.get('TYPING_REANNOUNCE_INTERVAL', 3.0))
+TYPING_EXPIRY = float(os.environ.get('TYPING_EXPIRY', 6.0))
+
+# WebSocket JWT logins: verified tokens are cached (never past their own
+# expiry) so reconnect storms don't hit the user table. Per-process, so
+# another worker sees a changed or deleted user within WS_AUTH_CACHE_TTL
+# seconds
+WS_AUTH_CACHE_SIZE = int(os.environ.get('WS_AUTH_CACHE_SIZE', 10000))
+WS_AUTH_CACHE_TTL = int(os.environ.get('WS_AUTH_CACHE_TTL', 60))
+
+# Who blocked whom, checked on every chat and call frame: kept in the
+# shared cache, each user's entry for at most BLOCK_INDEX_TTL seconds
+BLOCK_INDEX_TTL = int(os.environ.get('BLOCK_INDEX_TTL', 60))
+
+# Room event replay: the newest REPLAY_BUFFER_SIZE sequenced events of each
+# room are kept for clients resuming after a reconnect (for at most
+# REPLAY_BUFFER_ROOMS rooms per process); older gaps are served from the
+# database, up to REPLAY_DB_LIMIT messages
+REPLAY_BUFFER_SIZE = int(os.environ.get('REPLAY_BUFFER_SIZE', 256))
+REPLAY_BUFFER_ROOMS = int(os.environ.get('REPLAY_BUFFER_ROOMS', 10000))
+REPLAY_DB_LIMIT = int(os.environ.get('REPLAY_DB_LIMIT', 500))
+
+# Memory budget (approximate bytes) for the serialized newest page of
+# active rooms behind the message history endpoint
+RECENT_MESSAGES_CACHE_BYTES = int(os.environ.get('RECENT_MESSAGES_CACHE_BYTES', 32 * 1024 * 1024))
+
+# Username availability checks consult an in-memory Bloom filter of all
+# usernames first; it is rebuilt this often to see names taken elsewhere
+USERNAME_FILTER_REBUILD_INTERVAL = int(os.environ.get('USERNAME_FILTER_REBUILD_INTERVAL', 600))
+
+# Push notifications are queued and sent from a background thread: pushes
+# within PUSH_BATCH_WINDOW_MS go out in one batch, temporary failures are
+# retried (PUSH_RETRY_BACKOFF seconds, doubling) up to PUSH_MAX_ATTEMPTS
+# sends, and FCM tokens are cached for FCM_TOKEN_TTL seconds.
+# PUSH_TRANSPORT=accounts.push.FakeTransport records pushes instead of
+# sending them (local development, benchmarks)
+PUSH_TRANSPORT = os.environ.get('PUSH_TRANSPORT', 'accounts.push.FcmTransport')
+PUSH_BATCH_WINDOW_MS = int(os.environ.get('PUSH_BATCH_WINDOW_MS', 50))
+PUSH_MAX_ATTEMPTS = int(os.environ.get('PUSH_MAX_ATTEMPTS', 4))
+PUSH_RETRY_BACKOFF = float(os.environ.get('PUSH_RETRY_BACKOFF', 1.0))
+PUSH_MAX_QUEUE = int(os.environ.get('PUSH_MAX_QUEUE', 10000))
+FCM_TOKEN_TTL = int(os.environ.get('FCM_TOKEN_TTL', 600))
+
+# Room messages to members with no open socket are pushed from the server:
+# the first one at once, the ones that follow within this many seconds of
+# it as one more push
+OFFLINE_PUSH_WINDOW = float(os.environ.get('OFFLINE_PUSH_WINDOW', 3.0))
+
+# Conversation list pages (?limit=) are capped at this many rooms
+CONVERSATION_PAGE_MAX = int(os.environ.get('CONVERSATION_PAGE_MAX', 100))
 
 
 # Database